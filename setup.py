@@ -1,14 +1,4 @@
-from distutils.core import setup
-from setuptools import find_packages
-from glob import glob
-
-data = dict()
-app = 'trivup'
-data[app] = list()
-# Find Apps data
-for d in glob('trivup/apps/*App'):
-    data[app] += [x[x.find('apps/'):] for x in glob('%s/*' % d)
-                  if x[-1:] != '~']
+from setuptools import setup, find_packages
 
 setup(name='trivup',
       version='0.12.2',
@@ -18,15 +8,16 @@ setup(name='trivup',
       url='https://github.com/edenhill/trivup',
       license_files=['LICENSE'],
       packages=find_packages(),
-      package_data=data,
+      python_requires='>=3.7',
+      package_data={'trivup': ['apps/*App/*']},
+      exclude_package_data={'trivup': ['apps/*App/*~']},
       install_requires=[
           'requests',
           'jwcrypto',
-          'python_jwt'
+          'cryptography>=42'
       ],
       classifiers=[
           "Programming Language :: Python :: 3",
-          "Programming Language :: Python :: 2",
           "License :: OSI Approved :: BSD License",
           "Operating System :: OS Independent",
       ])
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+from trivup.apps import OauthbearerOIDCApp
+from trivup.apps.OauthbearerOIDCApp import WebServerHandler
+
+
+def test_token_cache(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(OauthbearerOIDCApp.time, 'time', lambda: now[0])
+
+    handler = WebServerHandler(sign_alg='HS256')
+    handler.update_keys()
+
+    token = handler.generate_token(3600)
+    # Reused within half the lifetime.
+    now[0] += 1799
+    assert handler.generate_token(3600) is token
+    # Cached per (lifetime, valid).
+    assert handler.generate_token(3600, valid=False) is not token
+    assert handler.generate_token(60) is not token
+
+    # Reissued after half the lifetime.
+    now[0] += 2
+    reissued = handler.generate_token(3600)
+    assert reissued is not token
+    assert reissued['access_token'] != token['access_token']
+
+    # Expired tokens are never cached.
+    assert handler.generate_token(-1) is not handler.generate_token(-1)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from trivup import trivup
+from trivup.apps import SchemaRegistryApp as sr_module
+from trivup.apps.ZookeeperApp import ZookeeperApp
+from trivup.apps.KafkaBrokerApp import KafkaBrokerApp
+from trivup.apps.SchemaRegistryApp import SchemaRegistryApp
+
+
+def test_operational_backoff(tmp_path, monkeypatch):
+    """ operational() probe caching and backoff, with a mocked clock
+        and probe: nothing is started. """
+    cluster = trivup.Cluster('TestCluster', str(tmp_path))
+    ZookeeperApp(cluster)
+    KafkaBrokerApp(cluster, {'version': '2.8.0'})
+    sr = SchemaRegistryApp(cluster, {'operational_ttl': 1.0,
+                                     'operational_min_interval': 0.25,
+                                     'operational_max_interval': 2.0})
+
+    now = [1000.0]
+    monkeypatch.setattr(sr_module.time, 'monotonic', lambda: now[0])
+    results = []
+    probes = []
+
+    def probe():
+        probes.append(now[0])
+        return results.pop(0)
+
+    monkeypatch.setattr(sr, '_probe', probe)
+
+    def operational_at(t, result=None):
+        """ Call operational() at time @param t, the probe (if any)
+            returns @param result.
+            @returns (operational() result, True if probed) """
+        now[0] = t
+        results[:] = [result]
+        cnt = len(probes)
+        return sr.operational(), len(probes) > cnt
+
+    # Failed probes back off also before the container is started.
+    assert operational_at(900.0, False) == (False, True)
+    assert operational_at(900.24) == (False, False)
+    assert operational_at(900.25, False) == (False, True)
+
+    sr.proc = object()
+
+    # Failed probes are retried after doubling intervals, up to the cap.
+    t = 1000.0
+    assert operational_at(t, False) == (False, True)
+    for interval in (0.25, 0.5, 1.0, 2.0, 2.0):
+        assert operational_at(t + interval - 0.01) == (False, False)
+        t += interval
+        assert operational_at(t, False) == (False, True)
+
+    # A successful probe is cached for operational_ttl and resets
+    # the backoff.
+    t += 2.0
+    assert operational_at(t, True) == (True, True)
+    assert operational_at(t + 0.99) == (True, False)
+    t += 1.0
+    assert operational_at(t, False) == (False, True)
+    assert operational_at(t + 0.49) == (False, False)
+    t += 0.5
+    assert operational_at(t, False) == (False, True)
+
+    # A restarted container process is probed at once, neither the
+    # backoff nor a cached success of the old process apply.
+    sr.proc = object()
+    t += 0.01
+    assert operational_at(t, True) == (True, True)
+    sr.proc = object()
+    assert operational_at(t + 0.01, False) == (False, True)
+    # The backoff starts over from operational_min_interval.
+    t += 0.01
+    assert operational_at(t + 0.24) == (False, False)
+    assert operational_at(t + 0.25, False) == (False, True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+from trivup.trivup import Cluster
+from trivup.apps.SslApp import SslApp
+
+
+def load_cert(path):
+    with open(path, 'rb') as f:
+        return x509.load_pem_x509_certificate(f.read())
+
+
+def public_der(key):
+    return key.public_key().public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+@pytest.mark.parametrize('through_intermediate', [False, True])
+def test_create_cert(tmp_path, through_intermediate):
+    """ create_cert() without keytool: the chain verifies against the CA,
+        the PKCS#12 loads with the password and the DER key matches
+        the PEM key. """
+    cluster = Cluster('TestCluster', str(tmp_path))
+    ssl = SslApp(cluster, conf={'ssl_cache_dir': ''})
+
+    r = ssl.create_cert('myclient', through_intermediate=through_intermediate)
+
+    ca = load_cert(ssl.ca['pem'])
+    cert = load_cert(r['pub']['pem'])
+    if through_intermediate:
+        intermediate = load_cert(r['intermediate_pub']['pem'])
+        intermediate.verify_directly_issued_by(ca)
+        cert.verify_directly_issued_by(intermediate)
+    else:
+        cert.verify_directly_issued_by(ca)
+
+    # The CA that signed the chain is in all_cas.pem, after the unused CA.
+    with open(ssl.all_cas['pem'], 'rb') as f:
+        all_cas = x509.load_pem_x509_certificates(f.read())
+    assert [x.subject for x in all_cas] == \
+        [load_cert(ssl.unused_ca['pem']).subject, ca.subject]
+
+    with open(r['pkcs'], 'rb') as f:
+        key, p12_cert, _ = pkcs12.load_key_and_certificates(
+            f.read(), r['password'].encode('utf-8'))
+    assert p12_cert == cert
+    assert public_der(key) == cert.public_key().public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    with open(r['priv']['pem'], 'rb') as f:
+        pem_key = serialization.load_pem_private_key(f.read(), None)
+    with open(r['priv']['der'], 'rb') as f:
+        der_key = serialization.load_der_private_key(f.read(), None)
+    assert public_der(der_key) == public_der(pem_key)
+    assert public_der(pem_key) == public_der(key)
+
+    cluster.cleanup()
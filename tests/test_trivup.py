@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import socket
+
+from trivup import trivup
+
+
+class DummyApp (trivup.App):
+    def operational(self):
+        return True
+
+    def deploy(self):
+        pass
+
+
+class OtherDummyApp (DummyApp):
+    pass
+
+
+def test_tcp_probe():
+    listening = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening.bind(('127.0.0.1', 0))
+    listening.listen(1)
+
+    # Bound but not listening: connections are refused.
+    closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed.bind(('127.0.0.1', 0))
+
+    try:
+        open_addr = listening.getsockname()
+        closed_addr = closed.getsockname()
+        assert trivup.tcp_probe([open_addr, closed_addr], timeout=2.0) == \
+            {open_addr}
+        assert trivup.tcp_probe([closed_addr], timeout=2.0) == set()
+        assert trivup.tcp_probe([], timeout=2.0) == set()
+    finally:
+        listening.close()
+        closed.close()
+
+
+def test_next_batch(tmp_path):
+    cluster = trivup.Cluster('TestCluster', str(tmp_path))
+    app = DummyApp(cluster)
+    allocator = trivup.TcpPortAllocator(cluster)
+
+    ports = allocator.next_batch(app, 5)
+    assert len(ports) == 5
+    assert len(set(ports)) == 5
+
+    # Ports are not handed out again.
+    more = allocator.next_batch(app, 5)
+    assert len(set(ports + more)) == 10
+    assert all(cluster.tcp_ports[p] is app for p in ports + more)
+
+    port_base = 23000
+    based = allocator.next_batch(app, 3, port_base=port_base)
+    assert len(set(based)) == 3
+    assert all(p >= port_base for p in based)
+    assert based == sorted(based)
+    assert not set(based) & set(ports + more)
+
+
+def test_find_app(tmp_path):
+    cluster = trivup.Cluster('TestCluster', str(tmp_path))
+    assert cluster.find_app(DummyApp) is None
+    assert cluster.find_apps(DummyApp) == []
+
+    a = DummyApp(cluster, conf={'role': 'a'})
+    b = DummyApp(cluster, conf={'role': 'b'})
+    c = OtherDummyApp(cluster, conf={'role': 'c'})
+
+    # By class, including subclasses, in creation order.
+    assert cluster.find_app(DummyApp) is a
+    assert cluster.find_apps(DummyApp) == [a, b, c]
+    assert cluster.find_apps(OtherDummyApp) == [c]
+    assert cluster.find_apps(trivup.App) == [a, b, c]
+
+    # By class name.
+    assert cluster.find_app('DummyApp') is a
+    assert cluster.find_app('OtherDummyApp') is c
+    assert cluster.find_app('NoSuchApp') is None
+
+    # By conf.
+    assert cluster.find_app(DummyApp, by_conf=('role', 'b')) is b
+    assert cluster.find_app(DummyApp, by_conf=('role', 'c')) is c
+    assert cluster.find_app(OtherDummyApp, by_conf=('role', 'a')) is None
+    assert cluster.find_app(DummyApp, by_conf=('role', 'x')) is None
+
+    # By state.
+    b.state = 'started'
+    assert cluster.find_apps(DummyApp, in_state='started') == [b]
+
+    # The returned list is a copy.
+    cluster.find_apps(DummyApp).clear()
+    assert cluster.find_apps(DummyApp) == [a, b, c]
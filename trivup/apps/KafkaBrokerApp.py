@@ -32,15 +32,50 @@ from trivup.apps.SslApp import SslApp
 from trivup.apps.OauthbearerOIDCApp import OauthbearerOIDCApp
 
 from string import Template
-import contextlib
+import fcntl
+import io
 import os
 import socket
+import subprocess
 import time
 
 
+# Static (broker-independent) SSL config
+_SSL_STATIC = (
+    'ssl.protocol=TLS',
+    'ssl.enabled.protocols=TLSv1.2,TLSv1.1,TLSv1',
+    'ssl.keystore.type = JKS',
+    'ssl.truststore.type = JKS')
+
+# Static (broker-independent) OAUTHBEARER OIDC config
+_OIDC_STATIC = (
+    'listener.name.sasl_plaintext.oauthbearer.sasl.server.callback.handler.class=org.apache.kafka.common.security.oauthbearer.secured.OAuthBearerValidatorCallbackHandler',  # noqa: E501
+    'listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.scope.claim.name=scp',  # noqa: E501
+    'listener.name.sasl_plaintext.oauthbearer.sasl.jaas.config=org.apache.kafka.common.security.oauthbearer.OAuthBearerLoginModule required unsecuredLoginStringClaim_sub="unused";',  # noqa: E501
+    'listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.expected.audience=api://default',  # noqa: E501
+    'security.inter.broker.protocol=PLAINTEXT',
+    'sasl.enabled.mechanisms=OAUTHBEARER')
+
+# JAAS LoginModule config for unsecured OAUTHBEARER JWTs
+_JAAS_OAUTHBEARER_UNSECURED = (
+    'org.apache.kafka.common.security.oauthbearer.OAuthBearerLoginModule required\n'  # noqa: E501
+    '  unsecuredLoginLifetimeSeconds="3600"\n'
+    '  unsecuredLoginStringClaim_sub="admin"\n'
+    '  unsecuredValidatorRequiredScope="requiredScope"\n'
+    ';\n')
+
+
 class KafkaBrokerApp (trivup.App):
     """ Kafka broker app
         Depends on ZookeeperApp (unless KRaft mode) """
+
+    # JAAS LoginModule plugin for SASL mechanisms with sasl_users.
+    # Kafka's ScramMechanism only implements SCRAM-SHA-256 and -512,
+    # there is no SCRAM-SHA-384.
+    sasl_plugins = {'PLAIN': 'plain.Plain',
+                    'SCRAM-SHA-256': 'scram.Scram',
+                    'SCRAM-SHA-512': 'scram.Scram'}
+
     def __init__(self, cluster, conf=None, on=None):
         """
         @param cluster     Current cluster
@@ -81,15 +116,15 @@ class KafkaBrokerApp (trivup.App):
             self.conf['version'] = 'trunk'
 
         if self.conf['version'] == 'trunk':
-            self.version = [9, 9, 9]
+            self.version = (9, 9, 9)
         else:
-            self.version = [int(x) for x in
-                            self.conf['version'].split('.')][:3]
+            self.version = tuple(int(x) for x in
+                                 self.conf['version'].split('.')[:3])
 
         self.zk = cluster.find_app('ZookeeperApp')
         if self.zk is None:
             # If AK >=2.8 we can run in KRaft-mode without ZK
-            if self.version < [2, 8, 0]:
+            if self.version < (2, 8, 0):
                 raise Exception('ZookeeperApp or AK >=2.8 required')
             self.kraft = True
         else:
@@ -101,6 +136,13 @@ class KafkaBrokerApp (trivup.App):
         listener_host = self.conf.get('listener_host',
                                       self.conf.get('nodename'))
         self.conf['listener_host'] = listener_host
+        # Resolve the listener host once, used by operational()
+        if listener_host not in ('*', ''):
+            try:
+                self.conf['listener_ip'] = socket.getaddrinfo(
+                    listener_host, None, socket.AF_INET)[0][4][0]
+            except socket.gaierror as e:
+                self.dbg(f'Failed to resolve {listener_host}: {e}')
 
         # Kafka Configuration properties
         self.conf['log_dirs'] = self.create_dir('logs')
@@ -127,41 +169,49 @@ class KafkaBrokerApp (trivup.App):
 
         # Arbitrary (non-template) configuration statements
         conf_blob = self.conf.get('conf', list())
-        jaas_blob = list()
+        jaas_buf = io.StringIO()
+        # Java options, added to KAFKA_OPTS in one go
+        kafka_opts = list()
 
         #
         # Configure listener types, SSL and SASL, CONTROLLER, etc.
         #
-        listener_types = self.conf.get('listeners', 'PLAINTEXT').split(',')
+        # Listener types are kept in an (insertion-ordered) dict
+        # to deduplicate them as they are added.
+        listener_types = dict.fromkeys(
+            self.conf.get('listeners', 'PLAINTEXT').split(','))
 
         if self.kraft:
             conf_blob.append('process.roles=broker,controller')
             conf_blob.append('controller.listener.names=CONTROLLER')
-            listener_types.append('CONTROLLER')
+            listener_types['CONTROLLER'] = None
         else:
             conf_blob.append('zookeeper.connect={}'.format(
                 self.conf.get('zk_connect')))
 
         # SASL support
-        sasl_mechs = [x for x in self.conf.get('sasl_mechanisms', '').
-                      replace(' ', '').split(',') if len(x) > 0]
+        sasl_mechanisms = self.conf.get('sasl_mechanisms', '')
+        if sasl_mechanisms:
+            sasl_mechs = [x for x in sasl_mechanisms.replace(' ', '').
+                          split(',') if len(x) > 0]
+        else:
+            sasl_mechs = []
         if len(sasl_mechs) > 0:
-            listener_types.append('SASL_PLAINTEXT')
+            listener_types['SASL_PLAINTEXT'] = None
 
         # SSL support
         ssl = cluster.find_app(SslApp)
         if ssl is not None:
             # Add SSL listener_types
-            listener_types.append('SSL')
+            listener_types['SSL'] = None
             if len(sasl_mechs) > 0:
-                listener_types.append('SASL_SSL')
+                listener_types['SASL_SSL'] = None
 
         listener_map = 'listener.security.protocol.map=' + \
             'PLAINTEXT:PLAINTEXT,SSL:SSL,SASL_PLAINTEXT:' + \
             'SASL_PLAINTEXT,SASL_SSL:SASL_SSL'
 
-        can_docker = self.conf['version'] == 'trunk' or \
-            int(self.conf['version'].split('.')[0]) > 0
+        can_docker = self.version[0] > 0
         if can_docker:
             # Map DOCKER listener to PLAINTEXT security protocol
             listener_map += ',DOCKER:PLAINTEXT'
@@ -171,100 +221,110 @@ class KafkaBrokerApp (trivup.App):
 
         conf_blob.append(listener_map)
 
-        def sort_listener(a):
-            """ Sort listener_types list so that the PLAINTEXTs are first,
-                since the first listener is used by operational(). """
-            if a.startswith('PLAINTEXT'):
-                return 0
-            else:
-                return 1
-
-        # Allocate a port for each listener type
-        ports = [(x, trivup.TcpPortAllocator(self.cluster).next(
-            self, self.conf.get('port_base', self.conf.get('port', None))))
-                 for x in sorted(set(listener_types), key=sort_listener)]
+        # Allocate a port for each listener type.
+        # The PLAINTEXTs are first, since the first listener is used
+        # by operational(), otherwise the configured order is kept.
+        listener_types = \
+            [x for x in listener_types if x.startswith('PLAINTEXT')] + \
+            [x for x in listener_types if not x.startswith('PLAINTEXT')]
+        port_alloc = trivup.TcpPortAllocator(self.cluster)
+        ports = list(zip(listener_types,
+                         port_alloc.next_batch(
+                             self, len(listener_types),
+                             self.conf.get('port_base',
+                                           self.conf.get('port', None)))))
         self.conf['port'] = ports[0][1]  # "Default" port
 
+        # Allocate the JMX port, and docker listener port if needed,
+        # outside of port_base.
+        extra_ports = port_alloc.next_batch(self, 2 if can_docker else 1)
+        jmx_port = extra_ports[0]
+
         if can_docker:
             # Add docker listener to allow services (e.g, SchemaRegistry) in
             # docker-containers to reach the on-host Kafka.
-            docker_port = trivup.TcpPortAllocator(self.cluster).next(self)
-            docker_host = '%s:%d' % (cluster.get_docker_host(), docker_port)
+            docker_port = extra_ports[1]
+            docker_host = f'{cluster.get_docker_host()}:{docker_port}'
 
-        self.conf['address'] = '%s:%d' % (listener_host, self.conf['port'])
-        # Create a listener for each port
-        listeners = ['%s://%s:%d' % (x[0], "0.0.0.0", x[1]) for x in ports]
-        if can_docker:
-            listeners.append('%s://%s:%d' % ('DOCKER', "0.0.0.0", docker_port))
-        self.conf['listeners'] = ','.join(listeners)
+        self.conf['address'] = f'{listener_host}:{self.conf["port"]}'
         if 'advertised_hostname' not in self.conf:
             self.conf['advertised_hostname'] = self.conf['nodename']
-        advertised_listeners = ['%s://%s:%d' %
-                                (x[0], self.conf['advertised_hostname'], x[1])
-                                for x in ports if x[0] != 'CONTROLLER']
+        advertised_hostname = self.conf['advertised_hostname']
+
+        # Create a listener, and advertised listener, for each port
+        listeners = [f'{proto}://0.0.0.0:{port}' for proto, port in ports]
+        advertised_listeners = [f'{proto}://{advertised_hostname}:{port}'
+                                for proto, port in ports
+                                if proto != 'CONTROLLER']
+        if 'CONTROLLER' in listener_types:
+            self.conf['controller_listener'] = \
+                listeners[listener_types.index('CONTROLLER')]
+
         if can_docker:
+            listeners.append(f'DOCKER://0.0.0.0:{docker_port}')
             # Expose service to docker containers as well.
-            advertised_listeners.append('DOCKER://%s' % docker_host)
-            self.conf['docker_advertised_listeners'] = 'PLAINTEXT://%s' % \
-                docker_host
+            advertised_listeners.append(f'DOCKER://{docker_host}')
+            self.conf['docker_advertised_listeners'] = \
+                f'PLAINTEXT://{docker_host}'
+        self.conf['listeners'] = ','.join(listeners)
         self.conf['advertised.listeners'] = ','.join(advertised_listeners)
         self.conf['advertised_listeners'] = self.conf['advertised.listeners']
-        if self.kraft:
-            self.conf['controller_listener'] = \
-                [x for x in listeners if x.startswith('CONTROLLER://')][0]
 
         self.conf['auto_create_topics'] = self.conf.get('auto_create_topics',
                                                         'true')
-        self.dbg('Listeners: %s' % self.conf['listeners'])
-        self.dbg('Advertised Listeners: %s' %
-                 self.conf['advertised.listeners'])
+        self.dbg(f'Listeners: {self.conf["listeners"]}')
+        self.dbg(f'Advertised Listeners: {self.conf["advertised.listeners"]}')
 
         self._add_simple_authorizer(conf_blob)
 
         if len(sasl_mechs) > 0:
-            self.dbg('SASL mechanisms: %s' % sasl_mechs)
-            jaas_blob.append('KafkaServer {')
+            self.dbg(f'SASL mechanisms: {sasl_mechs}')
+            jaas_buf.write('KafkaServer {\n')
 
-            conf_blob.append('sasl.enabled.mechanisms=%s' %
-                             ','.join(sasl_mechs))
+            conf_blob.append(
+                f'sasl.enabled.mechanisms={",".join(sasl_mechs)}')
             # Handle PLAIN and SCRAM-.. the same way
+            # Parse the user=pass,.. list once for all mechanisms.
+            sasl_users = [up.split('=') for up in
+                          self.conf.get('sasl_users', '').split(',')
+                          if len(up) > 0]
             for mech in sasl_mechs:
-                if mech.find('SCRAM') != -1:
-                    plugin = 'scram.Scram'
-                elif mech == 'PLAIN':
-                    plugin = 'plain.Plain'
-                else:
+                plugin = self.sasl_plugins.get(mech, None)
+                if plugin is None:
+                    if mech.startswith('SCRAM'):
+                        raise Exception(
+                            f'Unsupported SASL mechanism {mech}: expected '
+                            f'one of {", ".join(self.sasl_plugins)}')
                     continue
 
-                sasl_users = self.conf.get('sasl_users', '')
                 if len(sasl_users) == 0:
-                    self.log(('WARNING: No sasl_users configured for %s, '
-                              'expected CSV of user=pass,..') % plugin)
+                    self.log('WARNING: No sasl_users configured for '
+                             f'{plugin}, expected CSV of user=pass,..')
                 else:
-                    jaas_blob.append(('org.apache.kafka.common.security.'
-                                      '%sLoginModule required debug=true') %
-                                     plugin)
-                    for up in sasl_users.split(','):
-                        u, p = up.split('=')
-                        if plugin == 'plain.Plain':
-                            jaas_blob.append('  user_%s="%s"' % (u, p))
-                        elif plugin == 'scram.Scram':
-                            jaas_blob.append('  username="%s" password="%s"' %
-                                             (u, p))
+                    # Each user entry starts on a new line so that the
+                    # terminating ';' is appended to the last entry.
+                    jaas_buf.write('org.apache.kafka.common.security.'
+                                   f'{plugin}LoginModule required debug=true')
+                    if plugin == 'plain.Plain':
+                        jaas_buf.write(''.join(f'\n  user_{u}="{p}"'
+                                               for u, p in sasl_users))
+                    elif plugin == 'scram.Scram':
+                        for u, p in sasl_users:
+                            jaas_buf.write(
+                                f'\n  username="{u}" password="{p}"')
                             # SCRAM users are set up using kafka-configs.sh
-                            self.post_start_cmds.append((
-                                'JMX_PORT="" %s --bootstrap-server %s '
+                            self.post_start_cmds.append(
+                                f'JMX_PORT="" {kafka_configs_sh} '
+                                '--bootstrap-server '
+                                f'{self.conf["advertised_listeners"]} '
                                 '--alter --add-config '
-                                '\'%s=[iterations=4096,password=%s]\' '
-                                '--entity-type users --entity-name \'%s\'') % (
-                                    kafka_configs_sh,
-                                    self.conf['advertised_listeners'],
-                                    mech, p, u))
+                                f'\'{mech}=[iterations=4096,password={p}]\' '
+                                f'--entity-type users --entity-name \'{u}\'')
 
-                    jaas_blob[-1] += ';'
+                    jaas_buf.write(';\n')
 
             if 'GSSAPI' in sasl_mechs:
-                conf_blob.append('sasl.kerberos.service.name=%s' % 'kafka')
+                conf_blob.append('sasl.kerberos.service.name=kafka')
                 realm = self.conf.get('realm', None)
                 if realm is None:
                     kdc = self.cluster.find_app(KerberosKdcApp)
@@ -285,28 +345,24 @@ class KafkaBrokerApp (trivup.App):
                 assert kdc is not None, \
                     "No KerberosKdcApp found (realm={})".format(realm)
                 self.env_add('KRB5_CONFIG', kdc.conf['krb5_conf'])
-                self.env_add('KAFKA_OPTS', '-Djava.security.krb5.conf=%s' %
-                             kdc.conf['krb5_conf'])
-                self.env_add('KAFKA_OPTS', '-Dsun.security.krb5.debug=true')
+                kafka_opts.append('-Djava.security.krb5.conf='
+                                  f'{kdc.conf["krb5_conf"]}')
+                kafka_opts.append('-Dsun.security.krb5.debug=true')
                 self.kerberos_principal, self.kerberos_keytab = kdc.add_principal('kafka', self.conf['advertised_hostname'])  # noqa: E501
-                jaas_blob.append('com.sun.security.auth.module.Krb5LoginModule required')  # noqa: E501
-                jaas_blob.append('useKeyTab=true storeKey=true doNotPrompt=true')  # noqa: E501
-                jaas_blob.append('keyTab="%s"' % self.kerberos_keytab)
-                jaas_blob.append('debug=true')
-                jaas_blob.append('principal="%s";' % self.kerberos_principal)
+                jaas_buf.write(
+                    'com.sun.security.auth.module.Krb5LoginModule required\n'
+                    'useKeyTab=true storeKey=true doNotPrompt=true\n'
+                    f'keyTab="{self.kerberos_keytab}"\n'
+                    'debug=true\n'
+                    f'principal="{self.kerberos_principal}";\n')
 
             if 'OAUTHBEARER' in sasl_mechs:
                 oidcapp = self.cluster.find_app(OauthbearerOIDCApp)
                 if oidcapp is not None:
-                    assert self.version >= [3, 1, 0], "OIDC requires Apache Kafka 3.1 or later"
+                    assert self.version >= (3, 1, 0), "OIDC requires Apache Kafka 3.1 or later"
                     # Use the OIDC method.
-                    conf_blob.append('listener.name.sasl_plaintext.oauthbearer.sasl.server.callback.handler.class=org.apache.kafka.common.security.oauthbearer.secured.OAuthBearerValidatorCallbackHandler')
-                    conf_blob.append('listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.jwks.endpoint.url=%s' % oidcapp.conf['jwks_url'])
-                    conf_blob.append('listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.scope.claim.name=scp')
-                    conf_blob.append('listener.name.sasl_plaintext.oauthbearer.sasl.jaas.config=org.apache.kafka.common.security.oauthbearer.OAuthBearerLoginModule required unsecuredLoginStringClaim_sub="unused";')
-                    conf_blob.append('listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.expected.audience=api://default')
-                    conf_blob.append('security.inter.broker.protocol=PLAINTEXT')
-                    conf_blob.append('sasl.enabled.mechanisms=OAUTHBEARER')
+                    conf_blob.extend(_OIDC_STATIC)
+                    conf_blob.append(f'listener.name.sasl_plaintext.oauthbearer.sasl.oauthbearer.jwks.endpoint.url={oidcapp.conf["jwks_url"]}')
                 else:
                     # Use the unsecure JSON web token.
                     # Client should be configured with
@@ -317,48 +373,39 @@ class KafkaBrokerApp (trivup.App):
                     conf_blob.append('super.users=User:admin')
                     conf_blob.append('allow.everyone.if.no.acl.found=true')
                     self._add_simple_authorizer(conf_blob)
-                    jaas_blob.append('org.apache.kafka.common.security.oauthbearer.OAuthBearerLoginModule required')  # noqa: E501
-                    jaas_blob.append('  unsecuredLoginLifetimeSeconds="3600"')
-                    jaas_blob.append('  unsecuredLoginStringClaim_sub="admin"')
-                    jaas_blob.append('  unsecuredValidatorRequiredScope="requiredScope"')  # noqa: E501
-                    jaas_blob.append(';')
+                    jaas_buf.write(_JAAS_OAUTHBEARER_UNSECURED)
 
-            jaas_blob.append('};\n')
+            jaas_buf.write('};\n')
             self.conf['jaas_file'] = self.create_file('jaas_broker.conf',
-                                                      data='\n'.
-                                                      join(jaas_blob))
-            self.env_add('KAFKA_OPTS',
-                         '-Djava.security.auth.login.config=%s' %
-                         self.conf['jaas_file'])
+                                                      data=jaas_buf.getvalue())
+            kafka_opts.append('-Djava.security.auth.login.config='
+                              f'{self.conf["jaas_file"]}')
             if self.cluster.debug:
-                self.env_add('KAFKA_OPTS', '-Djava.security.debug=all')
+                kafka_opts.append('-Djava.security.debug=all')
 
         # SSL config and keys (et.al.)
         if ssl is not None:
-            keystore, truststore, _, _ = ssl.create_keystore('broker%s' %
-                                                             self.appid)
-            conf_blob.append('ssl.protocol=TLS')
-            conf_blob.append('ssl.enabled.protocols=TLSv1.2,TLSv1.1,TLSv1')
-            conf_blob.append('ssl.keystore.type = JKS')
-            conf_blob.append('ssl.keystore.location = %s' % keystore)
-            conf_blob.append('ssl.keystore.password = %s ' %
-                             ssl.conf.get('ssl_key_pass'))
-            conf_blob.append('ssl.key.password = %s' %
-                             ssl.conf.get('ssl_key_pass'))
-            conf_blob.append('ssl.truststore.type = JKS')
-            conf_blob.append('ssl.truststore.location = %s' % truststore)
-            conf_blob.append('ssl.truststore.password = %s' %
-                             ssl.conf.get('ssl_key_pass'))
-            conf_blob.append('ssl.client.auth = %s' %
-                             self.conf.get('ssl_client_auth', 'required'))
-
-        # Enable JMX
-        jmx_port = trivup.TcpPortAllocator(self.cluster).next(self)
+            keystore, truststore, _, _ = ssl.create_keystore(
+                f'broker{self.appid}')
+            ssl_key_pass = ssl.conf.get('ssl_key_pass')
+            conf_blob.extend(_SSL_STATIC)
+            conf_blob.append(f'ssl.keystore.location = {keystore}')
+            conf_blob.append(f'ssl.keystore.password = {ssl_key_pass} ')
+            conf_blob.append(f'ssl.key.password = {ssl_key_pass}')
+            conf_blob.append(f'ssl.truststore.location = {truststore}')
+            conf_blob.append(f'ssl.truststore.password = {ssl_key_pass}')
+            conf_blob.append('ssl.client.auth = '
+                             f'{self.conf.get("ssl_client_auth", "required")}')
+
+        # Enable JMX (port allocated above)
         # FIXME: JmxTool does not work when JMX is bound to listener_host,
         #        so we unfortunately can't bind to listener_host here.
         self.conf['jmx_port'] = jmx_port
         self.env_add('JMX_PORT', str(jmx_port))
 
+        if len(kafka_opts) > 0:
+            self.env_add('KAFKA_OPTS', ' '.join(kafka_opts))
+
         # Generate config file
         self.conf['conf_file'] = self.create_file_from_template('server.properties',  # noqa: E501
                                                                 self.conf,
@@ -366,10 +413,15 @@ class KafkaBrokerApp (trivup.App):
 
         # Generate LOG4J file (if app debug is enabled)
         if self.debug:
-            self.conf['log4j_file'] = self.create_file_from_template('log4j.properties', self.conf, subst=False)  # noqa: E501
-            self.env_add('KAFKA_LOG4J_OPTS',
-                         '-Dlog4j.configuration=file:%s' %
-                         self.conf['log4j_file'])
+            # The log4j config is the same for all brokers
+            # (LOG_DIR is set in the environment), so share one file.
+            self.conf['log4j_file'] = self.cluster.shared_file(
+                f'{self.__class__.__name__}/log4j.properties',
+                lambda: self.create_file_from_template('log4j.properties',
+                                                       self.conf,
+                                                       subst=False))
+            self.env_add('KAFKA_LOG4J_OPTS', '-Dlog4j.configuration=file:'
+                         f'{self.conf["log4j_file"]}')
 
         self.env_add('LOG_DIR', self.mkpath('debug'))
 
@@ -377,44 +429,46 @@ class KafkaBrokerApp (trivup.App):
         # This is the default for no-deploy use:
         # will be overwritten by deploy() if enabled.
 
-        self.conf['start_cmd'] = '%s %s' % (start_sh, self.conf['conf_file'])
+        self.conf['start_cmd'] = f'{start_sh} {self.conf["conf_file"]}'
         self.conf['stop_cmd'] = None  # Ctrl-C
 
     def operational(self):
         self.dbg('Checking if operational')
-        addr, port = self.get('address').split(':')
-        with contextlib.closing(socket.socket(socket.AF_INET,
-                                              socket.SOCK_STREAM)) as s:
-            return s.connect_ex((addr, int(port))) == 0
+        addr = self.operational_address()
+        return addr in trivup.tcp_probe([addr], timeout=0.25)
+
+    def operational_address(self):
+        """ @returns the broker's (listener IP, port), the listener host
+            is resolved once in the constructor since this is polled
+            repeatedly. """
+        ip = self.conf.get('listener_ip', None)
+        if ip is None:
+            ip = self.get('address').rsplit(':', 1)[0]
+        return (ip, self.conf['port'])
 
     def kraft_setup_storage(self):
         """ Set up KRaft storage """
-        cmd = '{}/kafka-storage.sh format -t {} -c {}'.format(
-            self.conf['bindir'],
-            self.cluster.uuid,
-            self.conf['conf_file'])
-        self.dbg('KRaft: setting up storage with: {}'.format(cmd))
-        r = os.system(cmd)
-        if r != 0:
+        cmd = [os.path.join(self.conf['bindir'], 'kafka-storage.sh'),
+               'format', '-t', self.cluster.uuid,
+               '-c', self.conf['conf_file']]
+        self.dbg('KRaft: setting up storage with: {}'.format(' '.join(cmd)))
+        try:
+            subprocess.run(cmd, check=True)
+        except subprocess.CalledProcessError as e:
             raise Exception('KRaft setup failed: "%s" returned exit code %d' %
-                            (cmd, r))
+                            (' '.join(cmd), e.returncode))
 
     def kraft_configure_controllers(self):
         """ Configure the KRaft controllers.
         Needs to be performed in the deploy stage when all KafkaBrokerApps have
         been instantiated. """
 
-        # Find all controllers (all KafkaBrokerApps for now) and construct
-        # a list of broker_id@host:port.
-        controllers = [
-            '{}@{}'.format(
-                x.appid, x.conf['controller_listener'].split('://')[-1])
-            for x in self.cluster.find_apps(self.__class__)]
+        # All KafkaBrokerApps are controllers for now.
+        voters = self.cluster.kraft_voters(self.__class__)
 
-        self.dbg('KRaft: controllers: {}'.format(controllers))
+        self.dbg('KRaft: controllers: {}'.format(voters))
         with open(self.conf['conf_file'], 'a') as f:
-            f.write('controller.quorum.voters={}\n'.format(
-                ','.join(controllers)))
+            f.write('controller.quorum.voters=' + voters + '\n')
 
     def kraft_setup(self):
         """ Set up KRaft. Should be called from deploy(). """
@@ -422,41 +476,96 @@ class KafkaBrokerApp (trivup.App):
         self.kraft_setup_storage()
 
     def deploy(self):
+        """ Deploy Kafka to a per-version directory that is shared by all
+            brokers in the cluster, deploy.sh is only run for the first
+            broker of each version. """
+        destdir = self._deploy_external()
+        self._deploy_finalize(destdir)
+
+    def _deploy_external(self):
+        """ Run deploy.sh for this broker's version (unless already deployed)
+            @returns destdir """
+        version = self.get('version')
         destdir = os.path.join(self.cluster.mkpath(self.__class__.__name__),
-                               'kafka', self.get('version'))
+                               'kafka', version)
         self.dbg('Deploy %s version %s on %s to %s' %
-                 (self.name, self.get('version'), self.node.name, destdir))
+                 (self.name, version, self.node.name, destdir))
         deploy_exec = self.resource_path('deploy.sh')
         if not os.path.exists(deploy_exec):
             raise NotImplementedError('Kafka deploy.sh script missing in %s' %
                                       deploy_exec)
         t_start = time.time()
-        cmd = '%s %s "%s" "%s"' % \
-              (deploy_exec, self.get('version'),
-               self.get('kafka_path', destdir), destdir)
-        self.dbg('Deploy command: {}'.format(cmd))
-        r = os.system(cmd)
-        if r != 0:
-            raise Exception('Deploy "%s" returned exit code %d' % (cmd, r))
-        self.dbg('Deployed version %s in %ds' %
-                 (self.get('version'), time.time() - t_start))
+        source = self.get('kafka_path', destdir)
+        cmd = [deploy_exec, version, source, destdir]
+        # All brokers of the same version share destdir: serialize deploys
+        # to it since they may run concurrently, and only
+        # run deploy.sh for the first one.
+        # The destdir may also be shared with other trivup processes
+        # using the same root_path, so take an exclusive file lock too
+        # and leave a sentinel file (holding the deploy source) behind on
+        # success, skipping deploy.sh altogether if it exists.
+        deploy_key = (self.name, version, source)
+        sentinel = destdir + '.trivup_deployed'
+        with self.cluster.lock(destdir):
+            if deploy_key in self.cluster.deploy_cache:
+                self.dbg('Version %s already deployed to %s' %
+                         (version, destdir))
+                return destdir
+
+            os.makedirs(os.path.dirname(destdir), exist_ok=True)
+            with open(destdir + '.trivup_deploy.lock', 'w') as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                if os.path.exists(sentinel):
+                    with open(sentinel, 'r') as f:
+                        deployed = f.read() == source
+                else:
+                    deployed = False
 
+                if deployed:
+                    self.dbg('Version %s already deployed to %s (%s exists)' %
+                             (version, destdir, sentinel))
+                else:
+                    self.dbg('Deploy command: {}'.format(' '.join(cmd)))
+                    try:
+                        subprocess.run(cmd, check=True)
+                    except subprocess.CalledProcessError as e:
+                        raise Exception('Deploy "%s" returned exit code %d' %
+                                        (' '.join(cmd), e.returncode))
+                    with open(sentinel, 'w') as f:
+                        f.write(source)
+                    self.dbg('Deployed version %s in %ds' %
+                             (version, time.time() - t_start))
+
+            self.cluster.deploy_cache[deploy_key] = destdir
+
+        return destdir
+
+    def _deploy_finalize(self, destdir):
+        """ Python-side post-deploy configuration of this broker """
+        bindir = os.path.join(destdir, 'bin')
         self.conf['destdir'] = destdir
-        self.conf['bindir'] = os.path.join(self.conf['destdir'], 'bin')
+        self.conf['bindir'] = bindir
 
         if self.kraft:
             self.kraft_setup()
 
         # Override start command with updated path.
-        self.conf['start_cmd'] = '%s/bin/kafka-server-start.sh %s' % \
-                                 (destdir, self.conf['conf_file'])
+        self.conf['start_cmd'] = '%s %s' % \
+            (os.path.join(bindir, 'kafka-server-start.sh'),
+             self.conf['conf_file'])
         self.dbg('Updated start_cmd to %s' % self.conf['start_cmd'])
         # Add kafka-dir/bin to PATH so that the bundled tools are
         # easily called.
-        self.env_add('PATH', os.environ.get('PATH') + ':' +
-                     os.path.join(destdir, 'bin'), append=False)
+        self.env_add('PATH', os.environ.get('PATH') + ':' + bindir,
+                     append=False)
 
     def _add_simple_authorizer(self, conf_blob):
+        # Only add the authorizer once, it may be requested by
+        # both the common and the SASL mechanism specific config.
+        if getattr(self, '_authorizer_added', False):
+            return
+        self._authorizer_added = True
+
         # Kafka removed SimpleAclAuthorizer class in v3.0.0
         # https://github.com/apache/kafka/commit/976e78e405d57943b989ac487b7f49119b0f4af4#diff-e0ccf1b5c964d2c303b6a69a8b8b67df5a6bfbae8aa514f580d353c4c6bf8e36
         if self.version[0] >= 3:
@@ -27,7 +27,10 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from trivup import trivup
+from concurrent.futures import ThreadPoolExecutor
 import os
+import subprocess
+import tempfile
 
 
 class KerberosKdcApp (trivup.App):
@@ -65,19 +68,19 @@ class KerberosKdcApp (trivup.App):
         # Set up cross-realm trusts, if desired.
         cross_realms = self.conf.get('cross_realms', '').split(',')
         if len(cross_realms) > 0 and cross_realms[0] != '':
-            cross_realms_conf = ""
-            capaths_conf = ""
+            cross_parts = list()
+            capaths_parts = list()
             for crinfo in cross_realms:
                 crealm, ckdc = crinfo.split('=')
                 if crealm == realm:
                     continue
-                cross_realms_conf += " %s = {\n  kdc = %s\n  admin_server = %s\n }\n" % (crealm, ckdc, ckdc)  # noqa: E501
-                capaths_conf += " %s = {\n  %s = .\n }\n" % (crealm, realm)
-                capaths_conf += " %s = {\n  %s = .\n }\n" % (realm, crealm)
+                cross_parts.append(f" {crealm} = {{\n  kdc = {ckdc}\n  admin_server = {ckdc}\n }}\n")  # noqa: E501
+                capaths_parts.append(f" {crealm} = {{\n  {realm} = .\n }}\n")
+                capaths_parts.append(f" {realm} = {{\n  {crealm} = .\n }}\n")
 
             self.conf['default_realm'] = cross_realms[0].split('=')[0]
-            self.conf['cross_realms'] = cross_realms_conf
-            self.conf['capaths'] = capaths_conf
+            self.conf['cross_realms'] = ''.join(cross_parts)
+            self.conf['capaths'] = ''.join(capaths_parts)
         else:
             self.conf['default_realm'] = realm
             self.conf['cross_realms'] = ''
@@ -92,7 +95,10 @@ class KerberosKdcApp (trivup.App):
         self.env_add('KRB5_KDC_PROFILE', self.conf['kdc_conf'])
 
         # Create database and stash file
-        r = self.execute('kdb5_util -P "" -r %(realm)s -d "%(dbpath)s" -sf "%(stash_file)s" create -s' % self.conf).wait()  # noqa: E501
+        r = self.execute(['kdb5_util', '-P', '', '-r', realm,
+                          '-d', self.conf['dbpath'],
+                          '-sf', self.conf['stash_file'],
+                          'create', '-s']).wait()
         if r != 0:
             raise Exception('Failed to create kdb5 database')
 
@@ -108,6 +114,40 @@ class KerberosKdcApp (trivup.App):
              sudo apt-get install krb5-kdc krb5-admin-server """
         pass
 
+    def kadmin(self, queries):
+        """
+        @brief Run kadmin.local queries on this KDC's database using a single
+               kadmin.local process, the queries are passed on stdin.
+               kadmin.local is started before the first query is produced
+               and each query is passed on as soon as it is available,
+               so @param queries may be a generator that does other work
+               (e.g., creating directories) while kadmin.local runs.
+               In this mode kadmin.local reports failed queries on stderr
+               but still exits with 0, so callers must verify the outcome.
+        @param queries iterable of kadmin query strings
+        @returns (kadmin.local exit code, combined stdout and stderr output)
+        """
+        with tempfile.TemporaryFile() as out:
+            proc = self.execute('kadmin.local -d "%s"' % self.conf['dbpath'],
+                                stdin_fd=subprocess.PIPE,
+                                stdout_fd=out.fileno(),
+                                stderr_fd=subprocess.STDOUT)
+            try:
+                for q in queries:
+                    proc.stdin.write((q + '\n').encode('utf-8'))
+                    proc.stdin.flush()
+            except BrokenPipeError:
+                # kadmin.local exited prematurely, see exit code.
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            r = proc.wait()
+            out.seek(0)
+            return r, out.read().decode('utf-8', 'replace')
+
     def add_principal(self, primary, instance=None):
         """
         @brief Add principal to server and generate keytab
@@ -115,38 +155,82 @@ class KerberosKdcApp (trivup.App):
         @param instance The principal instance, optional.
         @returns (principal string, keytab path)
         """
-        # Add principal
-        if instance is not None:
-            principal = '%s/%s@%s' % (primary, instance, self.conf['realm'])
-        else:
-            principal = '%s@%s' % (primary, self.conf['realm'])
-
-        r = self.execute('kadmin.local -d "%s" -q "addprinc -randkey %s"' %
-                         (self.conf.get('dbpath'), principal)).wait()
-        if r != 0:
-            raise Exception('ktadmin addprinc failed')
+        return self.add_principals([(primary, instance)])[0]
 
-        # Generate keytab
-        keytabdir = self.create_dir(os.path.join('keytabs', primary))
-        if instance is not None:
-            keytab = self.mkpath(os.path.join(keytabdir, instance))
-        else:
-            keytab = self.mkpath(os.path.join(keytabdir, "default"))
-
-        r = self.execute('kadmin.local -d "%s" -q "ktadd -k "%s" %s"' %
-                         (self.conf.get('dbpath'), keytab, principal)).wait()
-        if r != 0:
-            raise Exception('ktadmin ktadd failed')
-
-        # Return keytab path
-        return (principal, keytab)
+    def add_principals(self, specs):
+        """
+        @brief Add principals to server and generate their keytabs,
+               see add_principal().
+        @param specs list of (primary, instance) tuples, instance may be None.
+        @returns list of (principal string, keytab path)
+        """
+        realm = self.conf['realm']
+        result = list()
+
+        def queries():
+            for primary, instance in specs:
+                if instance is not None:
+                    principal = '%s/%s@%s' % (primary, instance, realm)
+                else:
+                    principal = '%s@%s' % (primary, realm)
+
+                # Add principal, kadmin.local works on it while
+                # the keytab directory is created.
+                yield 'addprinc -randkey %s' % principal
+
+                keytabdir = self.create_dir(os.path.join('keytabs', primary))
+                if instance is not None:
+                    keytab = self.mkpath(os.path.join(keytabdir, instance))
+                else:
+                    keytab = self.mkpath(os.path.join(keytabdir, "default"))
+
+                # Generate keytab
+                result.append((principal, keytab))
+                yield 'ktadd -k "%s" %s' % (keytab, principal)
+
+        r, output = self.kadmin(queries())
+
+        # A failed addprinc or ktadd leaves no keytab behind.
+        failed = [principal for principal, keytab in result
+                  if not os.path.exists(keytab) or
+                  os.path.getsize(keytab) == 0]
+        if r != 0 or len(result) < len(specs) or len(failed) > 0:
+            raise Exception('kadmin addprinc/ktadd failed for %s: %s' %
+                            (', '.join(failed) or
+                             'some of %d principal(s)' % len(specs),
+                             output.strip()))
+
+        # Return principals and keytab paths
+        return result
 
     @staticmethod
     def add_cross_realm_tgts(kdcs):
         """ Add cross-realm TGTs.
             kdcs is a dict indexed by realm name, value is KerberosKdcApp. """
-        realms = kdcs.keys()
-        for realm in realms:
-            for crealm in [x for x in realms if x != realm]:
-                kdcs[realm].execute('kadmin.local -d "{}" -q "addprinc -requires_preauth -pw password krbtgt/{}@{}"'.format(kdcs[realm].conf.get('dbpath'), crealm, realm)).wait()  # noqa: E501
-                kdcs[realm].execute('kadmin.local -d "{}" -q "addprinc -requires_preauth -pw password krbtgt/{}@{}"'.format(kdcs[realm].conf.get('dbpath'), realm, crealm)).wait()  # noqa: E501
+        realms = list(kdcs.keys())
+        realm_set = set(realms)
+
+        def run_for_realm(realm):
+            principals = list()
+            for crealm in sorted(realm_set - {realm}):
+                principals.append('krbtgt/{}@{}'.format(crealm, realm))
+                principals.append('krbtgt/{}@{}'.format(realm, crealm))
+            queries = ['addprinc -requires_preauth -pw password {}'.format(x)
+                       for x in principals]
+            # kadmin.local does not fail on failed queries,
+            # list the principals to verify they were added.
+            r, output = kdcs[realm].kadmin(queries + ['listprincs'])
+            listed = set(output.split())
+            missing = [x for x in principals if x not in listed]
+            if r != 0 or len(missing) > 0:
+                raise Exception('kadmin addprinc failed for %s: %s' %
+                                (', '.join(missing) or realm,
+                                 output.strip()))
+
+        if len(realms) == 0:
+            return
+
+        # The KDCs are independent of each other, so set them up
+        # concurrently.
+        with ThreadPoolExecutor(max_workers=len(realms)) as executor:
+            list(executor.map(run_for_realm, realms))
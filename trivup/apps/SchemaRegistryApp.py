@@ -29,11 +29,20 @@
 from trivup import trivup
 from trivup.apps.KafkaBrokerApp import KafkaBrokerApp
 
+import shlex
+import time
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
 
 
+# Schema Registry container environment shared by all instances,
+# as docker run arguments.
+_STATIC_ENV_ARGS = ('-e', 'SCHEMA_REGISTRY_HOST_NAME=localhost',
+                    '-e', 'SCHEMA_REGISTRY_DEBUG=true')
+
+
 class SchemaRegistryApp (trivup.App):
     """ Confluent Schema Registry app.
         Depends on KafkaBrokerApp.
@@ -41,6 +50,8 @@ class SchemaRegistryApp (trivup.App):
 
     default_image = 'confluentinc/cp-schema-registry'
     default_version = 'latest'
+    # Docker images known to be available locally, see deploy()
+    _pulled_images = set()
 
     def __init__(self, cluster, conf=None, on=None):
         """
@@ -53,15 +64,41 @@ class SchemaRegistryApp (trivup.App):
            * port_base - Low TCP port base to start allocating from (random)
            * image - docker image to use
            * conf - schema-registry docker image config strings (NOT USED)
+           * operational_ttl - seconds a successful operational() probe
+                               is remembered for (1.0)
+           * operational_timeout - operational() probe timeout (1.0)
+           * operational_min_interval - minimum time between
+                                        operational() probes (0.25)
+           * operational_max_interval - the interval is doubled after each
+                                        failed probe, up to this (5.0)
+           * operational_mode - 'tcp' to probe that the listener accepts
+                                connections, or 'http' to probe with a
+                                HEAD request (default: 'tcp' on linux,
+                                'http' elsewhere since docker's port
+                                forwarding accepts connections before the
+                                container listens)
         """
         super(SchemaRegistryApp, self).__init__(cluster, conf=conf, on=on)
+        # Keep-alive session for operational() polling, a single
+        # pooled connection is all that is needed.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        # (monotonic time, process) of the last successful probe,
+        # see operational().
+        self._op_cache = (0, None)
+        # (monotonic end time of the last probe, interval, process),
+        # see operational().
+        self._op_backoff = (0, 0, None)
 
         if self.conf.get('image', '') == '':
             self.conf['image'] = '{}:{}'.format(
                 self.default_image,
                 self.conf.get('version', self.default_version))
 
-        self.conf['container_id'] = 'trivup_sr_%s' % str(uuid.uuid4())[0:7]
+        self.conf['container_id'] = f'trivup_sr_{uuid.uuid4().hex[:7]}'
+        # An indexed lookup, see Cluster.find_app().
         kafka = cluster.find_app(KafkaBrokerApp)
         if kafka is None:
             raise Exception('KafkaBrokerApp required')
@@ -75,52 +112,135 @@ class SchemaRegistryApp (trivup.App):
         port = trivup.TcpPortAllocator(self.cluster).next(
             self, self.conf.get('port_base', None))
 
-        docker_args = ''
+        docker_args = []
         if cluster.platform == 'linux':
             # Let container bind to host localhost
             self.conf['extport'] = port
             self.conf['intport'] = port
-            docker_args = '--network=host'
+            docker_args = ['--network=host']
 
         elif cluster.platform == 'darwin':
             # On OSX localhost binds are not possible, so set up a
             # port forwarding.
             self.conf['extport'] = port
             self.conf['intport'] = 8081
-            docker_args = '-p %d:%d' % (self.conf['extport'],
-                                        self.conf['intport'])
+            docker_args = ['-p', '%d:%d' % (self.conf['extport'],
+                                            self.conf['intport'])]
 
         # This is the listener address inside the docker container
-        self.conf['listeners'] = 'http://0.0.0.0:%d' % self.conf.get('intport')
+        self.conf['listeners'] = f'http://0.0.0.0:{self.conf.get("intport")}'
         # This is the listener address outside the docker container,
         # using port-forwarding
-        self.conf['url'] = 'http://localhost:%d' % self.conf['extport']
-
-        # Run in foreground.
-        self.conf['start_cmd'] = 'docker run %s --name %s -e SCHEMA_REGISTRY_KAFKASTORE_BOOTSTRAP_SERVERS=%s  -e SCHEMA_REGISTRY_HOST_NAME=localhost   -e SCHEMA_REGISTRY_LISTENERS=%s  -e SCHEMA_REGISTRY_DEBUG=true %s' % (  # noqa: E501
-            docker_args,
-            self.conf.get('container_id'),
-            bootstrap_servers,
-            self.conf.get('listeners'),
-            self.conf.get('image'))
+        self.conf['url'] = f'http://localhost:{self.conf["extport"]}'
+        # Probe by address to avoid resolving localhost on each poll.
+        self._probe_url = f'http://127.0.0.1:{self.conf["extport"]}'
+        if self.conf.get('operational_mode', '') == '':
+            self.conf['operational_mode'] = \
+                'tcp' if cluster.platform == 'linux' else 'http'
+        if self.conf['operational_mode'] not in ('tcp', 'http'):
+            raise ValueError('Unsupported operational_mode %s' %
+                             self.conf['operational_mode'])
+
+        # Schema Registry container environment.
+        # The SCHEMA_REGISTRY_* names are literal, there is no
+        # per-key property name translation to redo.
+        env = (('KAFKASTORE_BOOTSTRAP_SERVERS', bootstrap_servers),
+               ('LISTENERS', self.conf.get('listeners')))
+        env_args = [x for k, v in env
+                    for x in ('-e', f'SCHEMA_REGISTRY_{k}={v}')]
+        env_args.extend(_STATIC_ENV_ARGS)
+
+        # Run in foreground, executed without a shell, see start_cmd().
+        self._start_cmd = ['docker', 'run', *docker_args,
+                           '--name', self.conf.get('container_id'),
+                           *env_args,
+                           self.conf.get('image')]
+        # Shell rendering of the same command for callers and debug output.
+        self.conf['start_cmd'] = ' '.join(shlex.quote(x)
+                                          for x in self._start_cmd)
 
         # Stop through docker
         self.conf['stop_cmd'] = 'docker stop %s' % \
                                 self.conf.get('container_id')
 
+    def start_cmd(self):
+        """ The docker run argument list, executed without a shell.
+            conf['start_cmd'] holds the equivalent shell command line. """
+        return self._start_cmd
+
     def operational(self):
-        self.dbg('Checking if %s is operational' % self.get('url'))
+        # A successful probe of the current container process is
+        # trusted for operational_ttl seconds.
+        now = time.monotonic()
+        cur_proc = getattr(self, 'proc', None)
+        ts, proc = self._op_cache
+        if proc is not None and proc is cur_proc and \
+           now - ts < self.conf.get('operational_ttl', 1.0):
+            return True
+
+        # Back off after failed probes: don't probe again until
+        # the current interval has passed since the last probe ended.
+        last_end, interval, proc = self._op_backoff
+        if proc is cur_proc and now - last_end < interval:
+            return False
+
+        ok = self._probe()
+
+        if ok:
+            self._op_cache = (now, cur_proc)
+            interval = self.conf.get('operational_min_interval', 0.25)
+        elif proc is cur_proc:
+            interval = min(max(interval * 2,
+                               self.conf.get('operational_min_interval',
+                                             0.25)),
+                           self.conf.get('operational_max_interval', 5.0))
+        else:
+            interval = self.conf.get('operational_min_interval', 0.25)
+        self._op_backoff = (time.monotonic(), interval, cur_proc)
+        return ok
+
+    def operational_address(self):
+        if self.conf['operational_mode'] == 'tcp':
+            return ('127.0.0.1', self.conf['extport'])
+        return None
+
+    def _probe(self):
+        """ Probe the Schema Registry REST endpoint, see operational_mode.
+            @returns True if it accepted a connection (tcp) or
+                     responded with a 2xx status (http). """
+        timeout = self.conf.get('operational_timeout', 1.0)
+        addr = self.operational_address()
+        if addr is not None:
+            self.dbg('Checking if %s:%d is operational' % addr)
+            return addr in trivup.tcp_probe([addr], timeout=timeout)
+
+        self.dbg('Checking if %s is operational' % self._probe_url)
         try:
-            r = requests.head(self.get('url'), timeout=1.0)
+            # HEAD responses have no body to download, and streaming
+            # them would close the kept-alive connection on r.close().
+            r = self._session.head(self._probe_url,
+                                   timeout=(min(0.5, timeout), timeout),
+                                   allow_redirects=False)
             if r.status_code >= 200 and r.status_code < 300:
                 return True
             raise Exception('status_code %d' % r.status_code)
         except Exception as e:
-            self.dbg('%s check failed: %s' % (self.get('url'), e))
+            self.dbg('%s check failed: %s' % (self._probe_url, e))
             return False
 
     def deploy(self):
         image = self.conf.get('image')
-        self.dbg('Pulling docker image: %s' % image)
-        subprocess.check_call('(docker images -q "%s" 2>/dev/null | grep -q ^.) || docker pull %s' % (image, image), shell=True)  # noqa: E501
-        pass
+        # Fast path for images already checked by this process, without
+        # taking the lock.
+        if image in self._pulled_images:
+            return
+        with self.cluster.lock('docker:' + image):
+            if image in self._pulled_images:
+                return
+            r = subprocess.run(['docker', 'image', 'inspect', image],
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+            if r.returncode != 0:
+                self.dbg('Pulling docker image: %s' % image)
+                subprocess.check_call(['docker', 'pull', image])
+            self._pulled_images.add(image)
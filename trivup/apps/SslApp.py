@@ -28,16 +28,37 @@
 
 from trivup import trivup
 
+from concurrent.futures import ThreadPoolExecutor
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+import datetime
+import hashlib
 import os
 import shutil
-from copy import copy
-from textwrap import dedent
+import threading
+from collections import ChainMap
+
+
+# ssl_key_algorithm EC curve names
+_EC_CURVES = {'prime256v1': ec.SECP256R1,
+              'secp256r1': ec.SECP256R1,
+              'P-256': ec.SECP256R1,
+              'secp384r1': ec.SECP384R1,
+              'P-384': ec.SECP384R1,
+              'secp521r1': ec.SECP521R1,
+              'P-521': ec.SECP521R1}
 
 
 class SslApp (trivup.App):
     """ Generates SSL certificates for use by other apps.
         This is not a running app but simply provides helper methods
-        to generate certificates, etc. """
+        to generate certificates, etc.
+        Keys and certificates are generated in-process, only the
+        Java keystores require keytool. """
 
     def __init__(self, cluster, conf=None, on=None):
         """
@@ -48,6 +69,34 @@ class SslApp (trivup.App):
         Honoured @param conf properties:
          * ssl_key_pass - SSL keytab password (default: 12345678)
          * SSL_{OU,O,L,S,ST,C} - (defaults: NN)
+         * ssl_key_algorithm - Algorithm of the keys generated for CA,
+                          client and intermediate certs:
+                          RSA:<bits> (e.g., RSA:2048, RSA:1024, RSA is
+                          RSA:2048),
+                          EC:<curve> (prime256v1, secp384r1, secp521r1,
+                          EC is EC:prime256v1) or
+                          ED25519.
+                          ED25519 is the fastest to generate and is
+                          recommended where the TLS peers support it
+                          (e.g., TLS 1.3 with OpenSSL >= 1.1.1, Java >= 15).
+                          Java keystore keys are always RSA.
+                          (default: RSA:2048)
+         * ssl_shared_key - For tests only: generate a single key and use
+                            it for both CA certs and all client and
+                            intermediate certs, saving the key generation
+                            for each cert. The certs are still told apart
+                            by their subjects and serials.
+                            Java keystore keys are never shared.
+                            (default: False)
+         * ssl_cache_dir - directory where CA certs, client certs and
+                           keystores are kept for reuse by later SslApp
+                           instances with the same subject, password,
+                           key type and CA, set to '' to always generate
+                           new ones. Cached files are copied to the app
+                           directory, the cache is never used in place.
+                           (default: $XDG_CACHE_HOME/trivup or
+                           ~/.cache/trivup, or '' if the TRIVUP_SSL_CACHE
+                           environment variable is set to 0)
 
         """
         super(SslApp, self).__init__(cluster, conf=conf, on=on)
@@ -60,6 +109,25 @@ class SslApp (trivup.App):
         self.conf.setdefault('ssl_S', 'S')
         self.conf.setdefault('ssl_C', 'NN')
         self.conf.setdefault('ssl_user', os.getenv('USER', 'NN'))
+        self.conf.setdefault('ssl_key_algorithm', 'RSA:2048')
+        self._key_spec, self._new_key = self._parse_key_algorithm(
+            self.conf['ssl_key_algorithm'])
+        self.conf.setdefault('ssl_shared_key', False)
+        if os.getenv('TRIVUP_SSL_CACHE', '1') == '0':
+            self.conf.setdefault('ssl_cache_dir', '')
+        else:
+            self.conf.setdefault('ssl_cache_dir', os.path.join(
+                os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                'trivup'))
+
+        # stdout for exec_cmd() subprocesses, see __del__()
+        self._devnull_fd = os.open(os.devnull, os.O_WRONLY)
+
+        # Issuer (cert, key) objects indexed by the issuer's cert PEM path.
+        self._issuers = dict()
+
+        # The ssl_shared_key key, set by the first create_ca_cert().
+        self._shared_key = None
 
         # Generate two CA certs, the first one will be unused and the second
         # one will be what everything else is signed with.
@@ -70,26 +138,294 @@ class SslApp (trivup.App):
         # Concatenate both PEMs to a single "all_cas" PEM file,
         # putting the unused CA first in the file.
         self.all_cas = {'pem': self.mkpath('all_cas.pem')}
-        with open(self.all_cas['pem'], 'w') as f:
+        with open(self.all_cas['pem'], 'wb') as f:
             for pemfile in [self.unused_ca['pem'], self.ca['pem']]:
-                      with open(pemfile, 'r') as pf:
-                            shutil.copyfileobj(pf, f)
-
-    def exec_cmd(self, cmd):
-        """ Run command with args, raise exception on failure. """
-        r = self.execute(cmd, stdout_fd=os.devnull).wait()
+                with open(pemfile, 'rb') as pf:
+                    f.write(pf.read())
+
+    def __del__(self):
+        fd = getattr(self, '_devnull_fd', None)
+        if fd is not None:
+            os.close(fd)
+
+    def exec_cmd(self, cmd, wait=True):
+        """ Run command with args, raise exception on failure.
+            With wait=False the process is returned without waiting for
+            it, pass it to wait_cmd() to check the outcome. """
+        proc = self.execute(cmd, stdout_fd=self._devnull_fd)
+        if not wait:
+            return proc
+        self.wait_cmd(proc, cmd)
+
+    def wait_cmd(self, proc, cmd):
+        """ Wait for exec_cmd(.., wait=False) @param proc,
+            raise exception on failure. """
+        r = proc.wait()
         if r != 0:
             raise Exception('%s exited with status code %d' % (cmd, r))
 
     def mksubj(self, cn):
         """ Generate a -subj argument string """
-        d = copy(self.conf)
-        d['ssl_CN'] = cn
+        d = ChainMap({'ssl_CN': cn}, self.conf)
         return "/C=%(ssl_C)s/ST=%(ssl_ST)s/L=%(ssl_L)s/O=%(ssl_O)s/CN=%(ssl_CN)s" % d  # noqa: E501
 
+    def mkname(self, cn):
+        """ Generate an X.509 name, the equivalent of mksubj() """
+        return x509.Name([
+            x509.NameAttribute(NameOID.COUNTRY_NAME, self.conf['ssl_C']),
+            x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME,
+                               self.conf['ssl_ST']),
+            x509.NameAttribute(NameOID.LOCALITY_NAME, self.conf['ssl_L']),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, self.conf['ssl_O']),
+            x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+
+    @staticmethod
+    def _parse_key_algorithm(alg):
+        """
+        Parse ssl_key_algorithm @param alg.
+        @returns (key_spec, key generator), where key_spec is the
+                 canonical ssl_key_algorithm, e.g., RSA:2048 for RSA.
+        @raises ValueError if @param alg is not supported.
+        """
+        name, _, arg = alg.partition(':')
+        name = name.upper()
+        try:
+            if name == 'RSA':
+                bits = int(arg or 2048)
+                if bits < 1024:
+                    raise ValueError('RSA key size must be at least 1024')
+                return ('RSA:%d' % bits,
+                        lambda: rsa.generate_private_key(
+                            public_exponent=65537, key_size=bits))
+            elif name == 'EC':
+                curve = _EC_CURVES[arg or 'prime256v1']
+                return ('EC:%s' % curve.name,
+                        lambda: ec.generate_private_key(curve()))
+            elif name == 'ED25519' and not arg:
+                return ('ED25519', ed25519.Ed25519PrivateKey.generate)
+        except (KeyError, ValueError) as e:
+            raise ValueError('Unsupported ssl_key_algorithm %s: %s' %
+                             (alg, e))
+        raise ValueError('Unsupported ssl_key_algorithm %s' % alg)
+
+    @staticmethod
+    def _hash_algorithm(key):
+        """ @returns the signature hash algorithm for signing with
+                     @param key, None for Ed25519 which has a fixed one. """
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            return None
+        return hashes.SHA256()
+
+    def _generate_key(self):
+        """ @returns a new private key, or the shared key if
+                     ssl_shared_key is set. """
+        if self._shared_key is not None:
+            return self._shared_key
+        key = self._new_key()
+        if self.conf['ssl_shared_key']:
+            self._shared_key = key
+        return key
+
+    @staticmethod
+    def _write_key(key, pem, der=None, password=None):
+        """ Write private @param key as PKCS#8 PEM, encrypted if
+            @param password is set, and optionally as traditional
+            (PKCS#1/SEC1) DER, or PKCS#8 DER for Ed25519 keys which have
+            no traditional format. """
+        if password:
+            encryption = serialization.BestAvailableEncryption(
+                password.encode('utf-8'))
+        else:
+            encryption = serialization.NoEncryption()
+        with open(pem, 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM,
+                                      serialization.PrivateFormat.PKCS8,
+                                      encryption))
+        if der is not None:
+            if isinstance(key, ed25519.Ed25519PrivateKey):
+                der_format = serialization.PrivateFormat.PKCS8
+            else:
+                der_format = serialization.PrivateFormat.TraditionalOpenSSL
+            with open(der, 'wb') as f:
+                f.write(key.private_bytes(serialization.Encoding.DER,
+                                          der_format,
+                                          serialization.NoEncryption()))
+
+    @staticmethod
+    def _write_cert(cert, pem, der=None):
+        """ Write @param cert as PEM and, optionally, DER.
+            Both are serialized from the in-memory certificate. """
+        with open(pem, 'wb') as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        if der is not None:
+            with open(der, 'wb') as f:
+                f.write(cert.public_bytes(serialization.Encoding.DER))
+
+    def _create_request(self, key, cn, path):
+        """ Create a certificate signing request for @param cn and
+            write it to @param path. """
+        req = x509.CertificateSigningRequestBuilder().subject_name(
+            self.mkname(cn)).sign(key, self._hash_algorithm(key))
+        with open(path, 'wb') as f:
+            f.write(req.public_bytes(serialization.Encoding.PEM))
+        return req
+
+    def _sign(self, subject, public_key, days, issuer_pem=None,
+              signing_key=None, extensions=None):
+        """
+        Issue a certificate.
+        @param subject     Subject x509.Name
+        @param public_key  Subject public key
+        @param days        Validity period
+        @param issuer_pem  Issuer cert PEM path, or None for a self-signed
+                           certificate signed by @param signing_key.
+        @param extensions  list of (extension, critical) tuples, if any.
+                           Subject and authority key identifiers are added
+                           to certificates with extensions.
+        @returns x509.Certificate
+        """
+        if issuer_pem is not None:
+            issuer_cert, signing_key = self._issuers[issuer_pem]
+            issuer = issuer_cert.subject
+            issuer_public_key = issuer_cert.public_key()
+        else:
+            issuer = subject
+            issuer_public_key = signing_key.public_key()
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        builder = x509.CertificateBuilder() \
+            .subject_name(subject) \
+            .issuer_name(issuer) \
+            .public_key(public_key) \
+            .serial_number(x509.random_serial_number()) \
+            .not_valid_before(now) \
+            .not_valid_after(now + datetime.timedelta(days=days))
+
+        if extensions:
+            for ext, critical in extensions:
+                builder = builder.add_extension(ext, critical=critical)
+            builder = builder.add_extension(
+                x509.SubjectKeyIdentifier.from_public_key(public_key),
+                critical=False)
+            builder = builder.add_extension(
+                x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                    issuer_public_key),
+                critical=False)
+
+        return builder.sign(signing_key, self._hash_algorithm(signing_key))
+
+    def _load_ca_cert(self, ret):
+        """ Load a previously created CA cert and key.
+            @returns (cert, key), or None if they are missing, do not
+                     match or the cert expires within a day. """
+        try:
+            with open(ret['pem'], 'rb') as f:
+                cert = x509.load_pem_x509_certificate(f.read())
+            # The key was generated by us: skip the (slow) RSA key
+            # validation, it is checked against the cert below.
+            with open(ret['key'], 'rb') as f:
+                key = serialization.load_pem_private_key(
+                    f.read(), password=ret['password'].encode('utf-8'),
+                    unsafe_skip_rsa_key_validation=True)
+            if not os.path.exists(ret['der']):
+                return None
+        except (OSError, ValueError, TypeError):
+            return None
+
+        spki = (serialization.Encoding.DER,
+                serialization.PublicFormat.SubjectPublicKeyInfo)
+        if cert.public_key().public_bytes(*spki) != \
+           key.public_key().public_bytes(*spki):
+            return None
+
+        if not self._valid_for_a_day(cert):
+            return None
+
+        return (cert, key)
+
+    @staticmethod
+    def _valid_for_a_day(cert):
+        """ @returns True if @param cert does not expire within a day. """
+        return cert.not_valid_after_utc - \
+            datetime.datetime.now(datetime.timezone.utc) >= \
+            datetime.timedelta(days=1)
+
+    def _cache_entry(self, kind, *parts):
+        """
+        @returns the ssl_cache_dir entry directory for @param kind
+                 (ca, cert, keystore) files identified by @param parts,
+                 or None if caching is disabled.
+        """
+        cache_dir = self.conf.get('ssl_cache_dir')
+        if not cache_dir:
+            return None
+        h = hashlib.sha256('|'.join(str(x) for x in (kind,) + parts)
+                           .encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache_dir, '%s_%s' % (kind, h))
+
+    def _cache_path(self, kind, cn, *args):
+        """
+        @returns the ssl_cache_dir entry directory for the @param kind
+                 (cert, keystore) files of @param cn, created with the
+                 current CAs and conf and @param args,
+                 or None if caching is disabled.
+        """
+        parts = [self.mksubj(cn), self.conf['ssl_OU'],
+                 self.conf['ssl_S'], self.conf['ssl_key_pass'],
+                 self._key_spec]
+        parts.extend(self._issuers[x['pem']][0].fingerprint(
+            hashes.SHA256()).hex() for x in (self.unused_ca, self.ca))
+        parts.extend(args)
+        return self._cache_entry(kind, *parts)
+
+    def _cache_restore(self, cache, paths, certs):
+        """
+        Copy the cached files for @param paths from @param cache.
+        @param certs  The paths of PEM certs that must not expire
+                      within a day for the cached files to be used.
+        @returns True if the files were restored, else False.
+        """
+        srcs = [os.path.join(cache, os.path.basename(x)) for x in paths]
+        try:
+            for path in certs:
+                with open(os.path.join(cache, os.path.basename(path)),
+                          'rb') as f:
+                    if not self._valid_for_a_day(
+                            x509.load_pem_x509_certificate(f.read())):
+                        return False
+            for src, path in zip(srcs, paths):
+                shutil.copyfile(src, path)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def _cache_store(self, cache, paths):
+        """ Copy @param paths to @param cache.
+            The files are copied to a temporary directory that is then
+            renamed in place, so the cache entry appears atomically.
+            Failing to cache is not an error, the files are in place. """
+        tmp = '%s.%d.%d.tmp' % (cache, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            for path in paths:
+                shutil.copyfile(path,
+                                os.path.join(tmp, os.path.basename(path)))
+        except OSError as e:
+            self.log('Failed to cache %s in %s: %s' %
+                     (', '.join(os.path.basename(x) for x in paths),
+                      cache, e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        try:
+            os.rename(tmp, cache)
+        except OSError:
+            # Already cached by someone else.
+            shutil.rmtree(tmp, ignore_errors=True)
+
     def create_ca_cert(self, cn):
         """
-        Create CA cert
+        Create CA cert, or reuse a cached one, see ssl_cache_dir.
+        The files are always in the app directory, cached ones are copied.
         @returns {'pem': .., 'der': .., 'key': .., 'srl': .., 'password': ..}
         """
         ret = {'key': self.mkpath('ca_%s.key' % cn),
@@ -98,15 +434,35 @@ class SslApp (trivup.App):
                'der': self.mkpath('ca_%s.der' % cn),
                'password': self.conf.get('ssl_key_pass')}
 
+        files = [ret['key'], ret['pem'], ret['der']]
+        cache = self._cache_entry('ca', self.mksubj(cn), ret['password'],
+                                  self._key_spec)
+        if cache is not None and \
+           self._cache_restore(cache, files, [ret['pem']]):
+            cached = self._load_ca_cert(ret)
+            if cached is not None:
+                self.dbg('Reusing cached CA cert for %s from %s' %
+                         (cn, cache))
+                self._issuers[ret['pem']] = cached
+                if self.conf['ssl_shared_key'] and self._shared_key is None:
+                    self._shared_key = cached[1]
+                return ret
+
         self.dbg('Generating CA cert for %s in %s' % (cn, ret['pem']))
-        self.exec_cmd('openssl req -new -x509 -keyout "%s" -out "%s" -days 10000 -passin "pass:%s" -passout "pass:%s" -subj "%s"' %  # noqa: E501
-                      (ret['key'], ret['pem'],
-                       ret['password'], ret['password'],
-                       self.mksubj(cn)))
-
-        self.dbg('Convert CA PEM to DER')
-        self.exec_cmd('openssl x509 -outform der -in "%s" -out "%s"' %
-                      (ret['pem'], ret['der']))
+        key = self._generate_key()
+        cert = self._sign(self.mkname(cn), key.public_key(), 10000,
+                          signing_key=key,
+                          extensions=[(x509.BasicConstraints(
+                              ca=True, path_length=None), True)])
+        self._write_key(key, ret['key'], password=ret['password'])
+        self._write_cert(cert, ret['pem'], ret['der'])
+        self._issuers[ret['pem']] = (cert, key)
+
+        if cache is not None:
+            # Replace a missing, expiring or unusable entry.
+            shutil.rmtree(cache, ignore_errors=True)
+            self._cache_store(cache, files)
+
         return ret
 
     def create_keystore(self, cn):
@@ -118,14 +474,15 @@ class SslApp (trivup.App):
         truststore = self.mkpath('%s.truststore.jks' % cn)
         cert = self.mkpath('%s.cert' % cn)
         signedcert = self.mkpath('%s.signedcert' % cn)
-        extfile = self.mkpath('%s.exts' % cn)
 
-        # Write extensions we need for signed certificate (openssl x509 -req)
-        with open(extfile, 'w') as f:
-            f.write('subjectAltName=DNS:localhost')
+        files = [keystore, truststore, cert, signedcert]
+        cache = self._cache_path('keystore', cn)
+        if cache is not None and \
+           self._cache_restore(cache, files, [signedcert]):
+            self.dbg('Reusing cached keystore for %s from %s' % (cn, cache))
+            return tuple(files)
 
-        d = copy(self.conf)
-        d.update({'ssl_CN': cn})
+        d = ChainMap({'ssl_CN': cn}, self.conf)
         inblob = """%(ssl_CN)s
 %(ssl_OU)s
 %(ssl_O)s
@@ -134,45 +491,92 @@ class SslApp (trivup.App):
 %(ssl_C)s
 yes""" % d
 
-        self.dbg('Generating key for %s: %s' % (cn, keystore))
-        self.exec_cmd('keytool -keyalg RSA -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -validity 10000 -genkey -ext SAN=DNS:localhost <<EOF\n%s\nEOF' %  # noqa: E501
-                      (self.conf.get('ssl_key_pass'),
-                       self.conf.get('ssl_key_pass'),
-                       keystore, inblob))
-
+        # The truststore is independent of the keystore,
+        # create it concurrently.
         self.dbg('Adding truststore for %s: %s' % (cn, truststore))
-        self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias CARoot -import -file "%s" <<EOF\nyes\nEOF' %  # noqa: E501
-                      (self.conf.get('ssl_key_pass'),
-                       self.conf.get('ssl_key_pass'),
-                       truststore, self.ca['pem']))
-
-        self.dbg('Export certificate for %s: %s' % (cn, cert))
-        self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -certreq -file "%s"' %  # noqa: E501
-                      (self.conf.get('ssl_key_pass'),
-                       self.conf.get('ssl_key_pass'),
-                       keystore, cert))
-
-        self.dbg('Sign certificate for %s' % cn)
-        self.exec_cmd('openssl x509 -req -CA "%s" -CAkey "%s" -in "%s" -out "%s" -days 10000 -CAcreateserial -passin "pass:%s" -extfile "%s"' %  # noqa: E501
-                      (self.ca['pem'], self.ca['key'],
-                       cert, signedcert,
-                       self.conf.get('ssl_key_pass'),
-                       extfile))
-
-        self.dbg('Import CA for %s' % cn)
-        self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias CARoot -import -file "%s" <<EOF\nyes\nEOF' %  # noqa: E501
-                      (self.conf.get('ssl_key_pass'),
-                       self.conf.get('ssl_key_pass'),
-                       keystore, self.ca['pem']))
-
-        self.dbg('Import signed CA for %s' % cn)
-        self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -import -file "%s"' %  # noqa: E501
-                      (self.conf.get('ssl_key_pass'),
-                       self.conf.get('ssl_key_pass'),
-                       keystore, signedcert))
+        truststore_cmd = ('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias CARoot -import -file "%s" <<EOF\nyes\nEOF' %  # noqa: E501
+                          (self.conf.get('ssl_key_pass'),
+                           self.conf.get('ssl_key_pass'),
+                           truststore, self.ca['pem']))
+        truststore_proc = self.exec_cmd(truststore_cmd, wait=False)
+
+        try:
+            self.dbg('Generating key for %s: %s' % (cn, keystore))
+            self.exec_cmd('keytool -keyalg RSA -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -validity 10000 -genkey -ext SAN=DNS:localhost <<EOF\n%s\nEOF' %  # noqa: E501
+                          (self.conf.get('ssl_key_pass'),
+                           self.conf.get('ssl_key_pass'),
+                           keystore, inblob))
+
+            self.dbg('Export certificate for %s: %s' % (cn, cert))
+            self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -certreq -file "%s"' %  # noqa: E501
+                          (self.conf.get('ssl_key_pass'),
+                           self.conf.get('ssl_key_pass'),
+                           keystore, cert))
+
+            self.dbg('Sign certificate for %s' % cn)
+            with open(cert, 'rb') as f:
+                req = x509.load_pem_x509_csr(f.read())
+            self._write_cert(
+                self._sign(req.subject, req.public_key(), 10000,
+                           issuer_pem=self.ca['pem'],
+                           extensions=[(x509.SubjectAlternativeName(
+                               [x509.DNSName('localhost')]), False)]),
+                signedcert)
+
+            self.dbg('Import CA for %s' % cn)
+            self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias CARoot -import -file "%s" <<EOF\nyes\nEOF' %  # noqa: E501
+                          (self.conf.get('ssl_key_pass'),
+                           self.conf.get('ssl_key_pass'),
+                           keystore, self.ca['pem']))
+
+            self.dbg('Import signed CA for %s' % cn)
+            self.exec_cmd('keytool -storepass "%s" -keypass "%s" -keystore "%s" -alias localhost -import -file "%s"' %  # noqa: E501
+                          (self.conf.get('ssl_key_pass'),
+                           self.conf.get('ssl_key_pass'),
+                           keystore, signedcert))
+        except BaseException:
+            truststore_proc.wait()
+            raise
+
+        self.wait_cmd(truststore_proc, truststore_cmd)
+
+        if cache is not None:
+            self._cache_store(cache, files)
 
         return (keystore, truststore, cert, signedcert)
 
+    def create_keystores(self, cns, max_workers=None):
+        """
+        Create signed Java keystores for each CN in @param cns,
+        see create_keystore().
+        The keystores are independent and mostly keytool-bound,
+        so they are created concurrently.
+        @param max_workers  Maximum concurrency (default: CPU count)
+        @returns list of (keystore, truststore, cert, signedcert), in
+                 @param cns order.
+        """
+        cns = list(cns)
+        if len(cns) == 0:
+            return []
+        max_workers = min(max_workers or os.cpu_count() or 1, len(cns))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.create_keystore, cns))
+
+    def create_certs(self, cns, max_workers=None, **kwargs):
+        """
+        Create certificates/keys for each CN in @param cns concurrently,
+        see create_cert() for the remaining arguments.
+        @param max_workers  Maximum concurrency (default: CPU count)
+        @returns list of create_cert() results, in @param cns order.
+        """
+        cns = list(cns)
+        if len(cns) == 0:
+            return []
+        max_workers = min(max_workers or os.cpu_count() or 1, len(cns))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda cn: self.create_cert(cn, **kwargs), cns))
+
     def create_cert(self, cn, through_intermediate=False, with_ca=True):
         """
         Create certificate/keys, in multiple formats (PEM, DER, PKCS#12),
@@ -200,53 +604,61 @@ yes""" % d
                'req': self.mkpath('%s.req' % cn),
                'password': password}
 
+        files = [ret['priv']['pem'], ret['priv']['der'],
+                 ret['pub']['pem'], ret['pub']['der'],
+                 ret['pkcs'], ret['req']]
+        certs = [ret['pub']['pem']]
+        if through_intermediate:
+            ret.update(self._intermediate_paths(cn))
+            files.extend([ret['intermediate_priv']['pem'],
+                          ret['intermediate_priv']['der'],
+                          ret['intermediate_pub']['pem'],
+                          ret['intermediate_pub']['der'],
+                          ret['intermediate_req']])
+            certs.append(ret['intermediate_pub']['pem'])
+
+        cache = self._cache_path('cert', cn, through_intermediate, with_ca)
+        if cache is not None and self._cache_restore(cache, files, certs):
+            self.dbg('Reusing cached cert for %s from %s' % (cn, cache))
+            return ret
+
         # Generate an intermediate cert, if this is required.
         if through_intermediate:
             ret.update(self._generate_intermediate(cn, with_ca=with_ca))
 
         self.dbg('Generating key for %s: %s' % (cn, ret['priv']['pem']))
-        self.exec_cmd('openssl genpkey -algorithm RSA -pass "pass:%s" -out "%s"' %  # noqa: E501
-                      (password, ret['priv']['pem']))
+        key = self._generate_key()
+        self._write_key(key, ret['priv']['pem'], ret['priv']['der'])
 
         self.dbg('Generating request for %s: %s' % (cn, ret['req']))
-        self.exec_cmd('openssl req -passin "pass:%s" -passout "pass:%s" -key "%s" -new -out "%s" -subj "%s"' %  # noqa: E501
-                      (password, password,
-                       ret['priv']['pem'], ret['req'], self.mksubj(cn)))
+        req = self._create_request(key, cn, ret['req'])
 
         if through_intermediate:
             self.dbg('Signing key for %s with intermediate cert' % (cn))
-            self.exec_cmd('openssl x509 -req -in "%s" -CA "%s" -CAkey "%s" -CAserial "%s" -out "%s"' %  # noqa: E501
-                        (ret['req'], ret['intermediate_pub']['pem'], ret['intermediate_priv']['pem'],
-                        self.ca['srl'], ret['pub']['pem']))
+            cert = self._sign(req.subject, key.public_key(), 30,
+                              issuer_pem=ret['intermediate_pub']['pem'])
         elif with_ca:
             self.dbg('Signing key for %s with CA cert' % (cn))
-            self.exec_cmd('openssl x509 -req -passin "pass:%s" -in "%s" -CA "%s" -CAkey "%s" -CAserial "%s" -out "%s"' %  # noqa: E501
-                        (password,
-                        ret['req'], self.ca['pem'], self.ca['key'],
-                        self.ca['srl'], ret['pub']['pem']))
+            cert = self._sign(req.subject, key.public_key(), 30,
+                              issuer_pem=self.ca['pem'])
         else:
             self.dbg('Signing key for %s with self' % (cn))
-            self.exec_cmd('openssl x509 -req -passin "pass:%s" -in "%s" -signkey "%s" -out "%s"' %  # noqa: E501
-                        (password,
-                        ret['req'], ret['priv']['pem'], ret['pub']['pem']))
+            cert = self._sign(req.subject, key.public_key(), 30,
+                              signing_key=key)
 
-        self.dbg('Converting public-key X.509 to DER for %s' % cn)
-        self.exec_cmd('openssl x509 -outform der -in "%s" -out "%s"' %  # noqa: E501
-                      (ret['pub']['pem'], ret['pub']['der']))
-
-        self.dbg('Converting private-key X.509 to DER for %s' % cn)
-        self.exec_cmd('openssl rsa -outform der -passin "pass:%s" -in "%s" -out "%s"' %  # noqa: E501
-                      (password, ret['priv']['pem'], ret['priv']['der']))
+        self._write_cert(cert, ret['pub']['pem'], ret['pub']['der'])
 
         self._export_pkcs12(
-            ret, cn, through_intermediate=through_intermediate, with_ca=with_ca)
+            ret, cn, through_intermediate=through_intermediate,
+            with_ca=with_ca, key=key, cert=cert)
+
+        if cache is not None:
+            self._cache_store(cache, files)
 
         return ret
 
-    def _generate_intermediate(self, cn, with_ca):
-        ssl_cfg = self.mkpath('%s.cnf' % cn)
-        password = self.conf.get('ssl_key_pass')
-        ret = {
+    def _intermediate_paths(self, cn):
+        return {
             'intermediate_priv': {'pem': self.mkpath('%s-intermediate-priv.pem' % cn),
                                   'der': self.mkpath('%s-intermediate-priv.der' % cn)},
             'intermediate_pub': {'pem': self.mkpath('%s-intermediate-pub.pem' % cn),
@@ -254,48 +666,39 @@ yes""" % d
             'intermediate_req': self.mkpath('%s-intermediate.req' % cn),
         }
 
-        with open(ssl_cfg, 'w') as f:
-            f.write(dedent("""
-                [req]
-                distinguished_name=dn
-                [ dn ]
-                [ ext ]
-                basicConstraints=CA:TRUE,pathlen:0
-            """))
+    def _generate_intermediate(self, cn, with_ca):
+        ret = self._intermediate_paths(cn)
 
         self.dbg('Generating key for %s intermediate: %s' %
                  (cn, ret['intermediate_priv']['pem']))
-        self.exec_cmd('openssl genpkey -algorithm RSA -out "%s"' %  # noqa: E501
-                    (ret['intermediate_priv']['pem']))
+        key = self._generate_key()
+        self._write_key(key, ret['intermediate_priv']['pem'],
+                        ret['intermediate_priv']['der'])
         self.dbg('Generating request for %s: %s' %
                  (cn, ret['intermediate_req']))
-        self.exec_cmd('openssl req -config "%s" -extensions ext -key "%s" -new -out "%s" -subj "%s"' %  # noqa: E501
-                (ssl_cfg, ret['intermediate_priv']['pem'], ret['intermediate_req'], self.mksubj('%s-intermediate' % (cn))))
+        req = self._create_request(key, '%s-intermediate' % (cn),
+                                   ret['intermediate_req'])
 
         # Work out if "intermediate" cert should be self-signed or actually signed by the CA.
         if with_ca:
             self.dbg('Signing key for %s intermediate with CA cert' % (cn))
-            self.exec_cmd('openssl x509 -req -extfile "%s" -extensions ext -passin "pass:%s" -in "%s" -CA "%s" -CAkey "%s" -CAserial "%s" -out "%s"' %  # noqa: E501
-                        (ssl_cfg, password,
-                        ret['intermediate_req'], self.ca['pem'], self.ca['key'],
-                        self.ca['srl'], ret['intermediate_pub']['pem']))
+            cert = self._sign(req.subject, key.public_key(), 30,
+                              issuer_pem=self.ca['pem'],
+                              extensions=[(x509.BasicConstraints(
+                                  ca=True, path_length=0), False)])
         else:
             self.dbg('Signing key for %s intermediate with self' % (cn))
-            self.exec_cmd('openssl x509 -req -passin "pass:%s" -in "%s" -signkey "%s" -out "%s"' %  # noqa: E501
-                        (password,
-                        ret['intermediate_req'], ret['intermediate_priv']['pem'], ret['intermediate_pub']['pem']))
-
-        self.dbg('Converting public-key X.509 to DER for %s intermediate' % cn)
-        self.exec_cmd('openssl x509 -outform der -in "%s" -out "%s"' %  # noqa: E501
-                    (ret['intermediate_pub']['pem'], ret['intermediate_pub']['der']))
+            cert = self._sign(req.subject, key.public_key(), 30,
+                              signing_key=key)
 
-        self.dbg('Converting private-key X.509 to DER for %s intermediate' % cn)
-        self.exec_cmd('openssl rsa -outform der -passin "pass:%s" -in "%s" -out "%s"' %  # noqa: E501
-                    (password, ret['intermediate_priv']['pem'], ret['intermediate_priv']['der']))
+        self._write_cert(cert, ret['intermediate_pub']['pem'],
+                         ret['intermediate_pub']['der'])
+        self._issuers[ret['intermediate_pub']['pem']] = (cert, key)
 
         return ret
 
-    def _export_pkcs12(self, ret, cn, through_intermediate, with_ca):
+    def _export_pkcs12(self, ret, cn, through_intermediate, with_ca,
+                       key, cert):
         password = self.conf.get('ssl_key_pass')
         additional_certs_for_pkcs12 = []
         if through_intermediate:
@@ -303,16 +706,24 @@ yes""" % d
         if with_ca:
             additional_certs_for_pkcs12.append(self.unused_ca['pem'])
             additional_certs_for_pkcs12.append(self.ca['pem'])
-        certfile_arguments = ' '.join(
-            ['-certfile "{}"'.format(c) for c in additional_certs_for_pkcs12])
+        # These used to be passed as repeated "openssl pkcs12 -certfile"
+        # arguments, of which openssl only honours the last one:
+        # keep the PKCS#12 contents as they were.
+        cas = [self._issuers[c][0] for c in additional_certs_for_pkcs12[-1:]]
+
+        # Triple-DES (cf. openssl pkcs12 -descert) and a SHA-1 MAC for
+        # compatibility with older PKCS#12 readers, e.g., Java 8 and
+        # OpenSSL 1.x, which can verify neither AES nor a SHA-256 MAC.
+        builder = serialization.PrivateFormat.PKCS12.encryption_builder()
+        encryption = builder.kdf_rounds(2048) \
+            .key_cert_algorithm(pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC) \
+            .hmac_hash(hashes.SHA1()) \
+            .build(password.encode('utf-8'))
 
         self.dbg('Creating PKCS#12 for %s in %s' % (cn, ret['pkcs']))
-        self.exec_cmd('openssl pkcs12 -export -descert -out "%s" -inkey "%s" -in "%s"  %s -passin "pass:%s" -passout "pass:%s"' %  # noqa: E501
-                      (ret['pkcs'],
-                       ret['priv']['pem'],
-                       ret['pub']['pem'],
-                       certfile_arguments,
-                       password, password))
+        with open(ret['pkcs'], 'wb') as f:
+            f.write(pkcs12.serialize_key_and_certificates(
+                None, key, cert, cas, encryption))
 
     def operational(self):
         return True
@@ -28,7 +28,9 @@
 
 from trivup import trivup
 from trivup.apps.KafkaBrokerApp import KafkaBrokerApp
+import contextlib
 import os
+import socket
 
 
 class ZookeeperApp (trivup.App):
@@ -52,6 +54,7 @@ class ZookeeperApp (trivup.App):
             self, port_base=self.conf.get('zk_port', None))
         self.conf['datadir'] = self.create_dir('datadir')
         self.conf['address'] = '%(nodename)s:%(port)d' % self.conf
+        self._cached_addr_ip = None
         # Generate config file
         self.conf['conf_file'] = self.create_file_from_template('zookeeper.properties', self.conf)  # noqa: E501
 
@@ -70,9 +73,33 @@ class ZookeeperApp (trivup.App):
 
     def operational(self):
         self.dbg('Checking if operational')
-        return os.system(('(echo srvr | nc %s | grep -q Zookeeper.version) '
-                          '2>/dev/null') %
-                         ' '.join(self.get('address').split(':'))) == 0
+        host, port = self.get('address').rsplit(':', 1)
+        if self._cached_addr_ip is None:
+            try:
+                self._cached_addr_ip = socket.gethostbyname(host)
+            except socket.error:
+                return False
+
+        # Send the 'srvr' four letter word and check that it is
+        # Zookeeper that responds.
+        resp = b''
+        try:
+            with contextlib.closing(socket.socket(socket.AF_INET,
+                                                  socket.SOCK_STREAM)) as s:
+                s.settimeout(0.2)
+                if s.connect_ex((self._cached_addr_ip, int(port))) != 0:
+                    return False
+                s.settimeout(1.0)
+                s.sendall(b'srvr')
+                while True:
+                    buf = s.recv(4096)
+                    if not buf:
+                        break
+                    resp += buf
+        except socket.error:
+            pass
+
+        return b'Zookeeper version' in resp
 
     def deploy(self):
         """ Deploy is a no-op for ZK since it is run from Kafka dir """
@@ -34,12 +34,17 @@ from uuid import uuid4
 from base64 import urlsafe_b64encode
 from copy import deepcopy
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
 import shutil
+import threading
 import time
 import pkgutil
 import pkg_resources
+import selectors
+import shlex
 import socket
+import errno
 import resource
 import datetime
 import sys
@@ -67,12 +72,26 @@ class Cluster (object):
             self.platform = sys.platform
 
         self.apps = list()
+        # Apps indexed by class (and base classes) and by class name,
+        # see find_app().
+        self._app_index = dict()
 
         self.root_path = os.path.join(os.path.abspath(root_path), name)
 
         self.appid_next = 1
         # Allocated TcpPortAllocator ports
         self.tcp_ports = dict()
+        # Deployed (app name, version, source) -> destdir, to avoid
+        # redeploying the same bits for each app instance.
+        self.deploy_cache = dict()
+        # Named locks, see lock()
+        self._locks = dict()
+        self._locks_lock = threading.Lock()
+        # KRaft controller.quorum.voters indexed by app class,
+        # see kraft_voters(), reset by add_app().
+        self._kraft_voters = dict()
+        # Shared files, see shared_file()
+        self._shared_files = dict()
 
     def log(self, msg):
         print('[%s] %s: %s' % (datetime.datetime.now(), self.name, msg))
@@ -91,44 +110,92 @@ class Cluster (object):
 
     def add_app(self, app):
         self.apps.append(app)
+        self._kraft_voters.clear()
+        self._app_index.setdefault(app.__class__.__name__, []).append(app)
+        for cls in app.__class__.__mro__:
+            self._app_index.setdefault(cls, []).append(app)
 
     def find_app(self, appclass, by_conf=None):
         """ Return an app instance matching appclass (string or type).
             If by_conf is set to a (name,value) tuple, the application's
             config property 'name' must have the value of 'value'.
+            Lookups are served from the per-class app index maintained
+            by add_app(), so this is cheap to call from each app's
+            constructor; by_conf lookups only scan apps of appclass.
         """
-        for app in self.apps:
-            if type(appclass) == str:
-                if app.__class__.__name__ != appclass:
-                    continue
-            elif not isinstance(app, appclass):
-                continue
+        apps = self._app_index.get(appclass, None)
+        if not apps:
+            return None
+        if by_conf is None:
+            return apps[0]
 
-            if by_conf is not None:
-                if app.conf.get(by_conf[0], None) != by_conf[1]:
-                    continue
-            return app
+        for app in apps:
+            if app.conf.get(by_conf[0], None) == by_conf[1]:
+                return app
 
         return None
 
     def find_apps(self, appclass, in_state=None):
         """ Returns a list of app instances matching appclass (type). """
-        apps = []
-        for app in self.apps:
-            if not isinstance(app, appclass):
-                continue
+        if in_state is None:
+            return list(self._app_index.get(appclass, []))
 
-            if in_state is not None and app.state != in_state:
+        apps = []
+        for app in self._app_index.get(appclass, []):
+            if app.state != in_state:
                 continue
 
             apps.append(app)
 
         return apps
 
+    def kraft_voters(self, appclass):
+        """ Returns the KRaft controller.quorum.voters value
+            (appid@host:port,..) for the controller_listener of all apps
+            of @param appclass.
+            The value is the same for all of them, so it is computed once
+            and cached until the next add_app(). """
+        voters = self._kraft_voters.get(appclass, None)
+        if voters is None:
+            voters = ','.join(
+                '{}@{}'.format(
+                    x.appid, x.conf['controller_listener'].split('://')[-1])
+                for x in self.find_apps(appclass))
+            self._kraft_voters[appclass] = voters
+        return voters
+
+    def lock(self, name):
+        """ Returns the cluster-wide lock for @param name, e.g., to serialize
+            concurrent deploys to the same destination path. """
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def shared_file(self, name, create):
+        """ Returns the path of the cluster-wide shared file @param name,
+            which is created by calling @param create() (returning the path)
+            the first time the file is requested. """
+        with self.lock('shared_file:' + name):
+            path = self._shared_files.get(name, None)
+            if path is None:
+                path = create()
+                self._shared_files[name] = path
+            return path
+
     def deploy(self):
-        """ @brief Deploy all apps in cluster """
-        for app in self.apps:
-            app.deploy()
+        """ @brief Deploy all apps in cluster.
+            Apps are deployed concurrently since deployment is mostly
+            I/O bound (downloads, extraction, docker pulls).
+            Docker images of different apps are thus pulled in parallel
+            with each other and with the other apps' deploys, while apps
+            sharing an image serialize on a per-image lock so that it is
+            only checked/pulled once (see SchemaRegistryApp.deploy()). """
+        if len(self.apps) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.apps)) as executor:
+            futures = [executor.submit(app.deploy) for app in self.apps]
+            for future in as_completed(futures):
+                # Propagate any deploy exception
+                future.result()
 
     def start(self, timeout=None):
         """
@@ -177,11 +244,23 @@ class Cluster (object):
         return False
 
     def wait_operational(self, timeout=30):
-        """ Wait for all started apps in the cluster to become operational """
+        """ Wait for all started apps in the cluster to become operational.
+            Apps are polled with exponential backoff (50ms..1s). """
         t_end = time.time() + timeout
+        delay = 0.05
         while time.time() < t_end:
-            not_oper = [x for x in self.apps
-                        if x.status() == 'started' and not x.operational()]
+            started = [x for x in self.apps if x.status() == 'started']
+            # Probe all apps with an operational_address() in one pass
+            addrs = {x: x.operational_address() for x in started}
+            reachable = tcp_probe([a for a in addrs.values() if a is not None])
+            not_oper = list()
+            for x in started:
+                if addrs[x] is None:
+                    oper = x.operational()
+                else:
+                    oper = addrs[x] in reachable
+                if not oper:
+                    not_oper.append(x)
             stopped = [x for x in self.apps if x.status() == 'stopped']
             if len(not_oper) == 0:
                 if len(stopped) > 0:
@@ -195,7 +274,8 @@ class Cluster (object):
                 return True
             self.dbg('Waiting for %d apps to go operational: %s' %
                      (len(not_oper), ', '.join([str(x) for x in not_oper])))
-            time.sleep(1)
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
         return False
 
     def get_all(self, key, defval=None, match_class=None):
@@ -230,6 +310,48 @@ class Cluster (object):
         raise Exception("Unsupported platform: {}".format(self.platform))
 
 
+def tcp_probe(addrs, timeout=1.0):
+    """ Connect to all (host, port) tuples in @param addrs concurrently
+        using non-blocking sockets.
+        @returns the set of addrs that accepted a connection
+                 within @param timeout seconds.
+    """
+    reachable = set()
+    sel = selectors.DefaultSelector()
+    try:
+        for addr in addrs:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            try:
+                r = s.connect_ex(addr)
+            except socket.error:
+                r = -1
+            if r in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sel.register(s, selectors.EVENT_WRITE, addr)
+                continue
+            if r == 0:
+                reachable.add(addr)
+            s.close()
+
+        t_end = time.time() + timeout
+        while len(sel.get_map()) > 0:
+            remaining = t_end - time.time()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                s = key.fileobj
+                if s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    reachable.add(key.data)
+                sel.unregister(s)
+                s.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+
+    return reachable
+
+
 class Allocator (object):
     def __init__(self, cluster):
         super(Allocator, self).__init__()
@@ -248,33 +370,52 @@ class TcpPortAllocator (Allocator):
             Linux tries to avoid returning the same port again, so this should
             work...
         """
+        return self.next_batch(app, 1, port_base=port_base)[0]
+
+    def next_batch(self, app, cnt, port_base=None):
+        """ Allocate @param cnt ports in one pass, see next().
+            All probe sockets are kept open until the batch is complete so
+            the kernel will not hand out the same port twice.
+            @returns list of port numbers
+        """
         if port_base is not None:
             port = port_base
         else:
             port = 0
 
-        for i in range(1, 100):
-            s = None
-            try:
+        ports = list()
+        socks = list()
+        try:
+            for i in range(1, 100):
+                if len(ports) == cnt:
+                    return ports
+
                 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.bind(('', port))
-                port = s.getsockname()[1]
-                s.close()
-            except Exception:
-                if s is not None:
-                    s.close()
+                socks.append(s)
+                try:
+                    s.bind(('', port))
+                except Exception:
+                    if port_base is not None:
+                        port += 1
+                        continue
+                    raise
+
+                bound_port = s.getsockname()[1]
                 if port_base is not None:
-                    port += 1
+                    port = bound_port + 1
+                if self.cluster.tcp_ports.get(bound_port, None) is not None:
                     continue
-                raise
-            if self.cluster.tcp_ports.get(port, None) is not None:
-                port += 1
-                continue
-            self.cluster.tcp_ports[port] = app
-            return port
+                self.cluster.tcp_ports[bound_port] = app
+                ports.append(bound_port)
+        finally:
+            for s in socks:
+                s.close()
+
+        if len(ports) == cnt:
+            return ports
 
-        raise Exception(("Could not allocate port (port_base=%s) "
-                         "in 100 attempts") % port_base)
+        raise Exception(("Could not allocate %d port(s) (port_base=%s) "
+                         "in 100 attempts") % (cnt, port_base))
 
 
 class UuidAllocator (Allocator):
@@ -297,6 +438,17 @@ class Node (object):
 
 
 class App (object):
+    # Parsed resource templates, keyed by resource path,
+    # see create_file_from_template().
+    _templates = dict()
+    # Rendered templates, keyed by (resource path, values of the
+    # template's identifiers), see create_file_from_template().
+    _rendered = dict()
+    _rendered_max = 256
+    # Resolved resource file paths, keyed by (class name, relpath),
+    # see resource_path().
+    _resources = dict()
+
     def __init__(self, cluster, conf=None, on=None):
         self.appid = Allocator(cluster).next(self)
         self.name = self.__class__.__name__
@@ -379,21 +531,26 @@ class App (object):
             os.makedirs(path)
         return path
 
-    def open_file(self, relpath, unique=False, pathtype='temp'):
+    def open_file(self, relpath, unique=False, pathtype='temp', buffering=-1):
         path = self.mkpath(relpath, unique=unique, pathtype=pathtype)
         basename = os.path.dirname(path)
         if not os.path.exists(basename):
             os.makedirs(basename)
-        f = open(path, 'wb')
+        f = open(path, 'wb', buffering=buffering)
 
         return f, path
 
     def create_file(self, relpath, unique=False, data=None, pathtype='temp'):
-        f, path = self.open_file(relpath, unique=unique, pathtype=pathtype)
+        # Unbuffered: the data is handed to the kernel in a single write()
+        # rather than being copied through a write buffer first.
+        f, path = self.open_file(relpath, unique=unique, pathtype=pathtype,
+                                 buffering=0)
         if data is not None:
             if type(data) == str:
                 data = data.encode('ascii')
-            f.write(data)
+            view = memoryview(data)
+            while len(view) > 0:
+                view = view[f.write(view):]
         f.close()
         return path
 
@@ -411,14 +568,34 @@ class App (object):
         # Try pkgutil resource locator
         tpath = os.path.join('apps', self.__class__.__name__,
                              tname + '.template')
-        filedata = pkgutil.get_data('trivup', tpath)
-        if filedata is None:
-            raise IOError('Class %s resource %s not found' % ('trivup', tpath))
+        template = App._templates.get(tpath, None)
+        if template is None:
+            filedata = pkgutil.get_data('trivup', tpath)
+            if filedata is None:
+                raise IOError('Class %s resource %s not found' %
+                              ('trivup', tpath))
+            template = Template(filedata.decode('ascii'))
+            # Identifiers referenced by the template, used for the
+            # rendered template cache key.
+            template.identifiers = tuple(dict.fromkeys(
+                m.group('named') or m.group('braced')
+                for m in template.pattern.finditer(template.template)
+                if m.group('named') or m.group('braced')))
+            App._templates[tpath] = template
 
         if subst:
-            rendered = Template(filedata.decode('ascii')).substitute(self.conf)
+            # Apps with the same config values for the identifiers used
+            # (e.g., multiple brokers or KDCs) render the same content.
+            key = (tpath,) + tuple(str(self.conf[x])
+                                   for x in template.identifiers)
+            rendered = App._rendered.get(key, None)
+            if rendered is None:
+                rendered = template.substitute(self.conf)
+                if len(App._rendered) >= App._rendered_max:
+                    App._rendered.clear()
+                App._rendered[key] = rendered
         else:
-            rendered = filedata.decode('ascii')
+            rendered = template.template
         if append_data is not None:
             rendered += '\n' + append_data + '\n'
         return self.create_file(relpath, unique, data=rendered,
@@ -426,29 +603,53 @@ class App (object):
 
     def resource_path(self, relpath):
         """ @returns the full path to an application class resource file """
-        return pkg_resources.resource_filename('trivup',
-                                               os.path.join('apps', self.__class__.__name__, relpath))  # noqa: E501
+        key = (self.__class__.__name__, relpath)
+        path = App._resources.get(key, None)
+        if path is None:
+            path = pkg_resources.resource_filename('trivup',
+                                                   os.path.join('apps', self.__class__.__name__, relpath))  # noqa: E501
+            App._resources[key] = path
+        return path
 
     def env_add(self, name, value, append=True):
-        """ Add (overwrite or append) environment variable """
+        """ Add (overwrite or append) environment variable.
+            Appended values are space-separated, e.g., for KAFKA_OPTS. """
         if name in self.env and append:
             self.env[name] += ' %s' % value
         else:
             self.env[name] = value
 
     def start_cmd(self):
-        """ @return Command line to start application. """
+        """ @return Command line (string or argument list) to start
+                    application, see execute(). """
         return self.conf['start_cmd']
 
-    def execute(self, cmd, stdout_fd=None, stderr_fd=None):
+    def execute(self, cmd, stdout_fd=None, stderr_fd=None, stdin_fd=None):
         """
         Execute command, returns the subprocess handle
 
+        @param cmd: either a shell command line string, or an argument
+                    list which is executed directly without a shell.
         @param stdout_fd, stderr_fd: either None (for no redirect), a fd,
                                      or a string (to open and append to file)
+        @param stdin_fd: either None (for /dev/null), a fd,
+                         or subprocess.PIPE.
         """
-        cmd = self.node.exec_cmd + cmd
-        self.dbg('Executing: %s' % cmd)
+        if isinstance(cmd, (list, tuple)):
+            if self.node.exec_cmd:
+                # The remote command is run by a shell (e.g., ssh joins
+                # the arguments), quote them to preserve empty arguments
+                # and whitespace.
+                cmd = shlex.split(self.node.exec_cmd) + \
+                    [' '.join(shlex.quote(x) for x in cmd)]
+            else:
+                cmd = list(cmd)
+            shell = False
+            self.dbg('Executing: %s' % ' '.join(shlex.quote(x) for x in cmd))
+        else:
+            cmd = self.node.exec_cmd + cmd
+            shell = True
+            self.dbg('Executing: %s' % cmd)
         self.dbg('Environment: %s' % str(self.env))
 
         fdlimit = self.conf.get('fdlimit', 0)
@@ -478,11 +679,12 @@ class App (object):
             stderr_fd = f.fileno()
             to_close.append(f)
 
-        f = open('/dev/null', 'r')
-        stdin_fd = f.fileno()
-        to_close.append(f)
+        if stdin_fd is None:
+            f = open('/dev/null', 'r')
+            stdin_fd = f.fileno()
+            to_close.append(f)
 
-        proc = subprocess.Popen(cmd, shell=True, preexec_fn=os.setsid,
+        proc = subprocess.Popen(cmd, shell=shell, start_new_session=True,
                                 env=dict(os.environ, **self.env),
                                 stdout=stdout_fd, stderr=stderr_fd,
                                 stdin=stdin_fd)
@@ -607,6 +809,12 @@ class App (object):
     def operational(self):
         return True  # Positive dummy: should be implemented by subclass
 
+    def operational_address(self):
+        """ @returns the (host, port) tuple that accepts TCP connections
+            when the app is operational, or None if operational() must be
+            used instead. Allows the cluster to probe apps in batch. """
+        return None
+
     def wait_operational(self, timeout=30):
         """ Wait for application to go operational """
         t_end = time.time() + timeout